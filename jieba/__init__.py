@@ -7,13 +7,21 @@ import os
 import sys
 import time
 import logging
-import marshal
 import tempfile
 import threading
+import weakref
+from array import array
+from functools import partial
 from math import log
 from hashlib import md5
 from ._compat import *
 from . import finalseg
+from .trie import DoubleArrayTrie, PrefixDict, PathBuffer
+from .trie import FORMAT_VERSION as TRIE_FORMAT_VERSION
+from .lru import LRUCache
+from .parallel import (ParallelTokenizer, split_text, chunk_size, start_pool,
+                       get_start_method, _init_globals, cut_lengths,
+                       search_spans, words_from_lengths, words_from_spans)
 
 if os.name == 'nt':
     from shutil import move as _replace_file
@@ -32,6 +40,13 @@ default_logger.addHandler(log_console)
 
 DICT_WRITING = {}
 
+# read-only dictionary models shared by the Tokenizers that load the same
+# dictionary, keyed by Tokenizer.get_dict_identity()
+MODEL_REGISTRY = weakref.WeakValueDictionary()
+_registry_locks = {}
+# content digests of dictionary files, keyed by (path, mtime, size)
+_dict_digests = {}
+
 pool = None
 
 re_userdict = re.compile('^(.+?)( [0-9]+)?( [a-z]+)?$', re.U)
@@ -55,7 +70,7 @@ def setLogLevel(log_level):
 
 class Tokenizer(object):
 
-    def __init__(self, dictionary=DEFAULT_DICT):
+    def __init__(self, dictionary=DEFAULT_DICT, hmm_model=None):
         self.lock = threading.RLock()
         if dictionary == DEFAULT_DICT:
             self.dictionary = dictionary
@@ -67,6 +82,13 @@ class Tokenizer(object):
         self.initialized = False
         self.tmp_dir = None
         self.cache_file = None
+        # bumped on every change of the dictionary, see enable_block_cache
+        self.dict_version = 0
+        self.block_cache = None
+        self.block_cache_version = None
+        # HMM for words not in the dictionary: hmm_model is an HMMModel,
+        # the path of a binary model file or None for the bundled one
+        self.segmenter = finalseg.Segmenter(hmm_model)
 
     def __repr__(self):
         return '<Tokenizer dictionary=%r>' % self.dictionary
@@ -92,6 +114,25 @@ class Tokenizer(object):
         f.close()
         return lfreq, ltotal
 
+    def gen_trie(self, f):
+        word_freq = []
+        word_tag = {}
+        f_name = resolve_filename(f)
+        for lineno, line in enumerate(f, 1):
+            try:
+                line = line.strip().decode('utf-8')
+                tup = line.split(' ')
+                word, freq = tup[:2]
+                word_freq.append((word, int(freq)))
+                if len(tup) > 2:
+                    word_tag[word] = tup[2]
+            except ValueError:
+                raise ValueError(
+                    'invalid dictionary entry in %s at Line %s: %s' % (f_name, lineno, line))
+        f.close()
+        trie = DoubleArrayTrie.build(word_freq, word_tag)
+        return trie, trie.total
+
     def initialize(self, dictionary=None):
         if dictionary:
             abs_path = _get_abs_path(dictionary)
@@ -114,116 +155,185 @@ class Tokenizer(object):
 
             default_logger.debug("Building prefix dict from %s ..." % (abs_path or 'the default dictionary'))
             t1 = time.time()
-            if self.cache_file:
-                cache_file = self.cache_file
-            # default dictionary
-            elif abs_path == DEFAULT_DICT:
-                cache_file = "jieba.cache"
-            # custom dictionary
-            else:
-                cache_file = "jieba.u%s.cache" % md5(
-                    abs_path.encode('utf-8', 'replace')).hexdigest()
-            cache_file = os.path.join(
-                self.tmp_dir or tempfile.gettempdir(), cache_file)
-            # prevent absolute path in self.cache_file
-            tmpdir = os.path.dirname(cache_file)
-
-            load_from_cache_fail = True
-            if os.path.isfile(cache_file) and (abs_path == DEFAULT_DICT or
-                os.path.getmtime(cache_file) > os.path.getmtime(abs_path)):
-                default_logger.debug(
-                    "Loading model from cache %s" % cache_file)
-                try:
-                    with open(cache_file, 'rb') as cf:
-                        self.FREQ, self.total = marshal.load(cf)
-                    load_from_cache_fail = False
-                except Exception:
-                    load_from_cache_fail = True
-
-            if load_from_cache_fail:
-                wlock = DICT_WRITING.get(abs_path, threading.RLock())
-                DICT_WRITING[abs_path] = wlock
-                with wlock:
-                    self.FREQ, self.total = self.gen_pfdict(self.get_dict_file())
-                    default_logger.debug(
-                        "Dumping model to file cache %s" % cache_file)
-                    try:
-                        # prevent moving across different filesystems
-                        fd, fpath = tempfile.mkstemp(dir=tmpdir)
-                        with os.fdopen(fd, 'wb') as temp_cache_file:
-                            marshal.dump(
-                                (self.FREQ, self.total), temp_cache_file)
-                        _replace_file(fpath, cache_file)
-                    except Exception:
-                        default_logger.exception("Dump cache file failed.")
-
-                try:
-                    del DICT_WRITING[abs_path]
-                except KeyError:
-                    pass
+            identity = self.get_dict_identity()
+            with _registry_locks.setdefault(identity, threading.Lock()):
+                trie = MODEL_REGISTRY.get(identity)
+                if trie is None:
+                    trie = self.load_trie()
+                    MODEL_REGISTRY[identity] = trie
+                else:
+                    default_logger.debug("Using the shared model of %s" % (
+                        abs_path or 'the default dictionary'))
+            # the model is shared, words added later go to this instance only
+            self.FREQ, self.total = PrefixDict(trie), trie.total
+            self.dict_version += 1
 
             self.initialized = True
             default_logger.debug(
                 "Loading model cost %.3f seconds." % (time.time() - t1))
             default_logger.debug("Prefix dict has been built successfully.")
 
+    def load_trie(self):
+        """
+        Load the dictionary trie from the cache file, building and caching
+        it if the cache is missing or stale.
+        """
+        abs_path = self.dictionary
+        # the default names carry the format version, so that versions of
+        # jieba sharing the temp dir do not overwrite each other's cache
+        if self.cache_file:
+            cache_file = self.cache_file
+        # default dictionary
+        elif abs_path == DEFAULT_DICT:
+            cache_file = "jieba.v%d.cache" % TRIE_FORMAT_VERSION
+        # custom dictionary
+        else:
+            cache_file = "jieba.u%s.v%d.cache" % (md5(
+                abs_path.encode('utf-8', 'replace')).hexdigest(), TRIE_FORMAT_VERSION)
+        cache_file = os.path.join(
+            self.tmp_dir or tempfile.gettempdir(), cache_file)
+        # prevent absolute path in self.cache_file
+        tmpdir = os.path.dirname(cache_file)
+
+        if os.path.isfile(cache_file) and (abs_path == DEFAULT_DICT or
+            os.path.getmtime(cache_file) > os.path.getmtime(abs_path)):
+            default_logger.debug(
+                "Loading model from cache %s" % cache_file)
+            try:
+                return DoubleArrayTrie.load(cache_file)
+            except Exception:
+                pass
+
+        wlock = DICT_WRITING.get(abs_path, threading.RLock())
+        DICT_WRITING[abs_path] = wlock
+        with wlock:
+            trie, _ = self.gen_trie(self.get_dict_file())
+            default_logger.debug(
+                "Dumping model to file cache %s" % cache_file)
+            try:
+                # prevent moving across different filesystems
+                fd, fpath = tempfile.mkstemp(dir=tmpdir)
+                with os.fdopen(fd, 'wb') as temp_cache_file:
+                    trie.dump(temp_cache_file)
+                _replace_file(fpath, cache_file)
+            except Exception:
+                default_logger.exception("Dump cache file failed.")
+
+        try:
+            del DICT_WRITING[abs_path]
+        except KeyError:
+            pass
+        return trie
+
+    def get_dict_identity(self):
+        """
+        Return (path, md5 hex digest of the content) of the dictionary.
+
+        Tokenizers whose dictionaries have the same identity share one
+        model through MODEL_REGISTRY.
+        """
+        if self.dictionary == DEFAULT_DICT:
+            key = None
+        else:
+            st = os.stat(self.dictionary)
+            key = (self.dictionary, st.st_mtime, st.st_size)
+        digest = _dict_digests.get(key)
+        if digest is None:
+            h = md5()
+            f = self.get_dict_file()
+            for chunk in iter(lambda: f.read(65536), b''):
+                h.update(chunk)
+            f.close()
+            digest = _dict_digests[key] = h.hexdigest()
+        return self.dictionary, digest
+
     def check_initialized(self):
         if not self.initialized:
             self.initialize()
 
+    def snapshot(self):
+        """
+        Return the configuration of the tokenizer as a picklable dict:
+        dictionary, cache location, HMM model and decoder, plus the words
+        added, tagged or force-split since the dictionary was loaded.
+
+        `Tokenizer.from_snapshot` rebuilds an equivalent tokenizer, e.g.
+        in a worker process. The HMM model must be the bundled one or
+        given by its path.
+        """
+        self.check_initialized()
+        segmenter = self.segmenter
+        if segmenter._model is not None and segmenter.model_path is None:
+            raise ValueError("jieba: only HMM models given by path can be snapshotted")
+        return {
+            'dictionary': self.dictionary,
+            'tmp_dir': self.tmp_dir,
+            'cache_file': self.cache_file,
+            'hmm_model': segmenter.model_path,
+            'decoder': segmenter.decoder_name,
+            'words': dict(self.FREQ.overlay),
+            'total': self.total,
+            'force_split_words': sorted(segmenter.force_split_words),
+            'word_tags': dict(self.user_word_tag_tab),
+        }
+
+    @classmethod
+    def from_snapshot(cls, state):
+        """
+        Return a tokenizer built from the result of `snapshot`.
+
+        The dictionary is loaded from its cache file, or from the model
+        already loaded in this process.
+        """
+        tk = cls(state['dictionary'], state['hmm_model'])
+        tk.tmp_dir = state['tmp_dir']
+        tk.cache_file = state['cache_file']
+        tk.initialize()
+        for word, freq in iteritems(state['words']):
+            tk.FREQ[word] = freq
+        tk.total = state['total']
+        tk.segmenter.set_decoder(state['decoder'])
+        tk.segmenter.force_split_words.update(state['force_split_words'])
+        tk.user_word_tag_tab.update(state['word_tags'])
+        return tk
+
     # 动态规划 计算最优路径
     def calc(self, sentence, DAG, route):
-        N = len(sentence)
-        route[N] = (0, 0)
-        logtotal = log(self.total)
-        # 从后往前遍历句子
-        for idx in xrange(N - 1, -1, -1):
-            # 对每个字计算最有可能的词组
-            route[idx] = max((log(self.FREQ.get(sentence[idx:x + 1]) or 1) - logtotal + route[x + 1][0], x) for x in DAG[idx])
+        # 从后往前遍历句子，对每个字计算最有可能的词组
+        # 词频沿trie一次查出，无需切片
+        self.FREQ.calc(sentence, DAG, route, log(self.total))
 
     # 输出有向无环图
     def get_DAG(self, sentence):
         self.check_initialized()
-        DAG = {}
-        N = len(sentence)
-        for k in xrange(N):
-            tmplist = []
-            i = k
-            # 提取字符段第k个字符
-            frag = sentence[k]
-            # 遍历查询dict.txt文件（349046行，第一列为词语，第二列为该词出现的频率，第三列为该词的词性）
-            while i < N and frag in self.FREQ:
-                if self.FREQ[frag]:
-                    tmplist.append(i)
-                i += 1
-                frag = sentence[k:i + 1]
-            if not tmplist:
-                tmplist.append(k)
-            DAG[k] = tmplist
-        return DAG
-
-    def __cut_all(self, sentence):
-        dag = self.get_DAG(sentence)
-        old_j = -1
-        for k, L in iteritems(dag):
-            if len(L) == 1 and k > old_j:
-                yield sentence[k:L[0] + 1]
-                old_j = L[0]
-            else:
-                for j in L:
-                    if j > k:
-                        yield sentence[k:j + 1]
-                        old_j = j
-
-    def __cut_DAG_NO_HMM(self, sentence):
-        DAG = self.get_DAG(sentence)
-        route = {}
-        self.calc(sentence, DAG, route)
+        # 在词典trie中查找以每个字符开头的所有词语
+        return self.FREQ.get_DAG(sentence)
+
+    # 一次从后往前的遍历同时完成查词和动态规划，
+    # 结果 ends[x] 为最优路径上从 x 开始的词的结束位置
+    def best_path(self, sentence, paths=None):
+        """
+        Return an array `ends` such that the word starting at x on the best
+        path is sentence[x:ends[x]]; the same path as get_DAG + calc.
+
+        `paths` is a PathBuffer whose arrays are reused between calls.
+        """
+        self.check_initialized()
+        return self.FREQ.best_path(sentence, log(self.total), paths)
+
+    # 全模式：查词与输出在同一次遍历中完成
+    def __cut_all(self, sentence, paths=None):
+        self.check_initialized()
+        for w in self.FREQ.cut_all(sentence):
+            yield w
+
+    def __cut_DAG_NO_HMM(self, sentence, paths=None):
+        ends = self.best_path(sentence, paths)
         x = 0
         N = len(sentence)
         buf = ''
         while x < N:
-            y = route[x][1] + 1
+            y = ends[x]
             l_word = sentence[x:y]
             if re_eng.match(l_word) and len(l_word) == 1:
                 buf += l_word
@@ -237,23 +347,28 @@ class Tokenizer(object):
         if buf:
             yield buf
             buf = ''
+    # 未登录词交由HMM切分；传入 pending 时推迟解码：缓冲区记入 pending，
+    # 以 None 占位，由 cut_batch 批量解码后填回
+    def __cut_OOV(self, buf, pending=None):
+        if pending is None:
+            return self.segmenter.cut(buf)
+        pending.append(buf)
+        return (None,)
+
     # HMM下使用的切词
-    def __cut_DAG(self, sentence):
+    def __cut_DAG(self, sentence, paths=None, pending=None):
         # sentence：我来到北京清华大学
-        # 输出对应的DAG图数据
-        DAG = self.get_DAG(sentence)
+        # 对应的DAG图数据（见get_DAG）
         # {0: [0], 1: [1, 2], 2: [2], 3: [3, 4], 4: [4], 5: [5, 6, 8], 6: [6, 7], 7: [7, 8], 8: [8]}
         # DAG[5]=[5,6,8]的意思就是，以’清‘开头的话，分别以5、6、8结束时，可以是一个词语，即’清‘、’清华‘、’清华大学‘
-        route = {}
-        # 计算route
-        self.calc(sentence, DAG, route)
-        # route: 
-        # {9: (0, 0), 8: (-8.142626068614787, 8), 7: (-8.006816355818659, 8), 6: (-17.53722513662092, 6), 5: (-11.085007904198626, 8), 4: (-20.20431518448597, 4), 3: (-18.548194315526874, 4), 2: (-24.22732015246924, 2), 1: (-27.379629658355885, 2), 0: (-32.587853155857076, 0)}
+        # 计算最优路径
+        ends = self.best_path(sentence, paths)
+        # ends[:9]: [1, 3, 3, 5, 5, 9, 7, 9, 9]
         x = 0
         buf = ''
         N = len(sentence)
         while x < N:
-            y = route[x][1] + 1
+            y = ends[x]
             l_word = sentence[x:y]
             # 无法形成词的buf，交由HMM进行标注
             if y - x == 1:
@@ -267,7 +382,7 @@ class Tokenizer(object):
                         if not self.FREQ.get(buf):
                             # 当遇到一些dict.txt中没出现的词的时候，会进入这个函数
                             # 使用HMM的方法，对这些未识别成功的词进行标注
-                            recognized = finalseg.cut(buf)
+                            recognized = self.__cut_OOV(buf, pending)
                             for t in recognized:
                                 yield t
                         else:
@@ -283,9 +398,7 @@ class Tokenizer(object):
             elif not self.FREQ.get(buf):
                 # 当遇到一些dict.txt中没出现的词的时候，会进入这个函数
                 # 使用HMM的方法，对这些未识别成功的词进行标注
-                print(buf)
-                recognized = finalseg.cut(buf)
-                print(recognized)
+                recognized = self.__cut_OOV(buf, pending)
                 for t in recognized:
                     yield t
             else:
@@ -305,7 +418,11 @@ class Tokenizer(object):
             - HMM: Whether to use the Hidden Markov Model.
         '''
         sentence = strdecode(sentence)
+        # 各文本块共用的最优路径数组
+        paths = PathBuffer()
+        return self.__cut_blocks(sentence, cut_all, HMM, paths)
 
+    def __cut_blocks(self, sentence, cut_all, HMM, paths, pending=None):
         if cut_all:
             re_han = re_han_cut_all
             re_skip = re_skip_cut_all
@@ -314,10 +431,13 @@ class Tokenizer(object):
             re_skip = re_skip_default
         if cut_all:
             cut_block = self.__cut_all
+        elif pending is not None:
+            cut_block = partial(self.__cut_DAG, pending=pending)
         elif HMM:
             cut_block = self.__cut_DAG
         else:
             cut_block = self.__cut_DAG_NO_HMM
+        cache = self.get_block_cache()
         # 按正则先把成块的文本切开         
         # blocks： ['', '我来到北京清华大学', '，', '今天天气不错', ',', 'good', ' ', 'day', '!']
         blocks = re_han.split(sentence)
@@ -325,8 +445,20 @@ class Tokenizer(object):
             if not blk:
                 continue
             if re_han.match(blk):
+                if cache is not None:
+                    # 重复出现的文本块直接取缓存结果
+                    key = (blk, cut_all, HMM)
+                    words = cache.get(key)
+                    if words is None:
+                        words = tuple(cut_block(blk, paths))
+                        # 含待解码占位的结果不缓存
+                        if pending is None or None not in words:
+                            cache[key] = words
+                    for word in words:
+                        yield word
+                    continue
                 # 对文本块使用__cut_DAG进一步切词                
-                for word in cut_block(blk):
+                for word in cut_block(blk, paths):
                     yield word
             else:
                 tmp = re_skip.split(blk)
@@ -343,7 +475,9 @@ class Tokenizer(object):
         """
         Finer segmentation for search engines.
         """
-        words = self.cut(sentence, HMM=HMM)
+        return self.__expand_for_search(self.cut(sentence, HMM=HMM))
+
+    def __expand_for_search(self, words):
         for w in words:
             if len(w) > 2:
                 for i in xrange(len(w) - 1):
@@ -360,6 +494,54 @@ class Tokenizer(object):
     def lcut(self, *args, **kwargs):
         return list(self.cut(*args, **kwargs))
 
+    def cut_batch(self, texts, cut_all=False, HMM=True, flat=False):
+        """
+        Segment many texts in one call, as `lcut` on each of them.
+
+        Duplicate texts are segmented once, and with the HMM the unknown
+        words of all the texts are decoded together by the batch decoder
+        of the segmenter. Returns a list of word lists, or with
+        `flat=True` a pair (words, offsets) where the words of texts[i]
+        are words[offsets[i]:offsets[i + 1]].
+        """
+        self.check_initialized()
+        paths = PathBuffer()
+        if cut_all or not HMM:
+            return _cut_batch(texts, lambda text: list(self.__cut_blocks(
+                strdecode(text), cut_all, HMM, paths)), flat)
+        return _cut_batch(texts, lambda text: self.__cut_deferred(text, paths),
+                          flat, self.__decode_pending)
+
+    def cut_for_search_batch(self, texts, HMM=True, flat=False):
+        """
+        Batch version of `lcut_for_search`, see `cut_batch`.
+        """
+        self.check_initialized()
+        paths = PathBuffer()
+        if not HMM:
+            return _cut_batch(texts, lambda text: list(self.__expand_for_search(
+                self.__cut_blocks(strdecode(text), False, HMM, paths))), flat)
+        return _cut_batch(texts, lambda text: self.__cut_deferred(text, paths), flat,
+                          partial(self.__decode_pending, expand=self.__expand_for_search))
+
+    def __cut_deferred(self, text, paths):
+        # (words with None in place of the unknown words, their buffers)
+        pending = []
+        words = list(self.__cut_blocks(strdecode(text), False, True, paths, pending))
+        return words, pending
+
+    def __decode_pending(self, results, expand=None):
+        # the buffers of all the texts go through segmenter.cut_batch, which
+        # decodes the blocks missing from its memo with decode_batch
+        bufs = list(set(buf for words, pending in itervalues(results) for buf in pending))
+        segmented = dict(zip(bufs, self.segmenter.cut_batch(bufs)))
+        for text in results:
+            words, pending = results[text]
+            words = _fill_pending(words, pending, segmented)
+            if expand is not None:
+                words = list(expand(words))
+            results[text] = words
+
     def lcut_for_search(self, *args, **kwargs):
         return list(self.cut_for_search(*args, **kwargs))
 
@@ -431,6 +613,7 @@ class Tokenizer(object):
         freq = int(freq) if freq is not None else self.suggest_freq(word, False)
         self.FREQ[word] = freq
         self.total += freq
+        self.dict_version += 1
         if tag:
             self.user_word_tag_tab[word] = tag
         for ch in xrange(len(word)):
@@ -438,7 +621,7 @@ class Tokenizer(object):
             if wfrag not in self.FREQ:
                 self.FREQ[wfrag] = 0
         if freq == 0:
-            finalseg.add_force_split(word)
+            self.segmenter.add_force_split(word)
 
     def del_word(self, word):
         """
@@ -517,11 +700,88 @@ class Tokenizer(object):
                 raise Exception("jieba: file does not exist: " + abs_path)
             self.dictionary = abs_path
             self.initialized = False
+            self.dict_version += 1
+
+    def enable_block_cache(self, maxsize=10000):
+        """
+        Cache the words of up to `maxsize` recently cut Chinese blocks,
+        keyed by (block, cut_all, HMM).
+
+        The cache is emptied when the dictionary changes (add_word,
+        del_word, load_userdict, set_dictionary) or when a word is added
+        to the force-split words of the segmenter. Its hits and misses are
+        reported by block_cache_info().
+        """
+        self.block_cache = LRUCache(maxsize)
+
+    def disable_block_cache(self):
+        self.block_cache = None
+
+    def block_cache_info(self):
+        if self.block_cache is None:
+            return None
+        return self.block_cache.info()
+
+    def get_block_cache(self):
+        """
+        Return the block cache, emptied if the dictionary changed since it
+        was filled, or None if caching is off.
+        """
+        cache = self.block_cache
+        if cache is not None:
+            version = (self.dict_version, self.segmenter.force_split_version)
+            if self.block_cache_version != version:
+                cache.clear()
+                self.block_cache_version = version
+        return cache
+
+
+def _cut_batch(texts, lcut, flat, resolve=None):
+    # results of distinct texts, duplicates get a copy; resolve(results)
+    # turns the results of lcut into word lists in place
+    texts = list(texts)
+    results = {}
+    for text in texts:
+        if text not in results:
+            results[text] = lcut(text)
+    if resolve is not None:
+        resolve(results)
+    out = []
+    seen = set()
+    for text in texts:
+        words = results[text]
+        if text in seen:
+            words = list(words)
+        else:
+            seen.add(text)
+        out.append(words)
+    if not flat:
+        return out
+    flat_words = []
+    offsets = array('i', [0])
+    for words in out:
+        flat_words.extend(words)
+        offsets.append(len(flat_words))
+    return flat_words, offsets
+
+
+def _fill_pending(words, pending, segmented):
+    # replace the None placeholders of words by the segmented buffers
+    bufs = iter(pending)
+    out = []
+    for w in words:
+        if w is None:
+            out.extend(segmented[next(bufs)])
+        else:
+            out.append(w)
+    return out
 
 
 # default Tokenizer instance
 
 dt = Tokenizer()
+# the default tokenizer shares the segmenter of the finalseg functions
+dt.segmenter = finalseg.dseg
 
 # global functions
 
@@ -532,6 +792,11 @@ cut = dt.cut
 lcut = dt.lcut
 cut_for_search = dt.cut_for_search
 lcut_for_search = dt.lcut_for_search
+cut_batch = dt.cut_batch
+enable_block_cache = dt.enable_block_cache
+disable_block_cache = dt.disable_block_cache
+block_cache_info = dt.block_cache_info
+cut_for_search_batch = dt.cut_for_search_batch
 del_word = dt.del_word
 get_DAG = dt.get_DAG
 get_dict_file = dt.get_dict_file
@@ -567,35 +832,65 @@ def _lcut_for_search_no_hmm(s):
     return dt._lcut_for_search_no_hmm(s)
 
 
+# the workers of the pool return the lengths of the words in their chunk of
+# text, see jieba.parallel
+
+def _cut_lengths(s):
+    return cut_lengths(dt, s)
+
+
+def _cut_lengths_no_hmm(s):
+    return cut_lengths(dt, s, False)
+
+
+def _search_spans(s):
+    return search_spans(dt, s)
+
+
+def _search_spans_no_hmm(s):
+    return search_spans(dt, s, False)
+
+
+def _pmap(func, sentence, pattern=re_han_default):
+    """
+    Return the chunks of `sentence` and the results of `func` on them
+    from the pool. Chunks end where a block of `pattern` starts, see
+    split_text.
+    """
+    sentence = strdecode(sentence)
+    chunks = list(split_text([sentence], pattern, chunk_size(sentence)))
+    return chunks, pool.map(func, chunks)
+
+
 def _pcut(sentence, cut_all=False, HMM=True):
-    parts = strdecode(sentence).splitlines(True)
     if cut_all:
-        result = pool.map(_lcut_all, parts)
-    elif HMM:
-        result = pool.map(_lcut, parts)
-    else:
-        result = pool.map(_lcut_no_hmm, parts)
-    for r in result:
-        for w in r:
+        for r in _pmap(_lcut_all, sentence, re_han_cut_all)[1]:
+            for w in r:
+                yield w
+        return
+    chunks, result = _pmap(_cut_lengths if HMM else _cut_lengths_no_hmm, sentence)
+    for chunk, lengths in zip(chunks, result):
+        for w in words_from_lengths(chunk, lengths):
             yield w
 
 
 def _pcut_for_search(sentence, HMM=True):
-    parts = strdecode(sentence).splitlines(True)
-    if HMM:
-        result = pool.map(_lcut_for_search, parts)
-    else:
-        result = pool.map(_lcut_for_search_no_hmm, parts)
-    for r in result:
-        for w in r:
+    chunks, result = _pmap(_search_spans if HMM else _search_spans_no_hmm, sentence)
+    for chunk, spans in zip(chunks, result):
+        for w in words_from_spans(chunk, spans):
             yield w
 
 
-def enable_parallel(processnum=None):
+def enable_parallel(processnum=None, start_method=None):
     """
     Change the module's `cut` and `cut_for_search` functions to the
     parallel version.
 
+    `start_method` is the multiprocessing start method of the workers,
+    None for the default. Forked workers inherit `dt`; with 'spawn' or
+    'forkserver' they load it from a snapshot of its dictionary, user
+    words and tags, as they are when the pool starts.
+
     Note that this only works using dt, custom Tokenizer
     instances are not supported.
     """
@@ -604,12 +899,17 @@ def enable_parallel(processnum=None):
     if os.name == 'nt':
         raise NotImplementedError(
             "jieba: parallel mode only supports posix system")
-    else:
-        from multiprocessing import Pool
     dt.check_initialized()
     if processnum is None:
         processnum = cpu_count()
-    pool = Pool(processnum)
+    if get_start_method(start_method) == 'fork':
+        pool = start_pool(processnum, start_method=start_method)
+    else:
+        from . import posseg
+        states = (posseg.dt.snapshot(),)
+        if posseg.dt.tokenizer is not dt:
+            states += (dt.snapshot(),)
+        pool = start_pool(processnum, _init_globals, states, start_method)
     cut = _pcut
     cut_for_search = _pcut_for_search
 
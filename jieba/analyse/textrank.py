@@ -61,12 +61,14 @@ class TextRank(KeywordExtractor):
         self.stop_words = self.STOP_WORDS.copy()
         self.pos_filt = frozenset(('ns', 'n', 'vn', 'v'))
         self.span = 5
+        # passed to the POS tagger, None for exact decoding
+        self.beam_width = None
 
     def pairfilter(self, wp):
         return (wp.flag in self.pos_filt and len(wp.word.strip()) >= 2
                 and wp.word.lower() not in self.stop_words)
 
-    def textrank(self, sentence, topK=20, withWeight=False, allowPOS=('ns', 'n', 'vn', 'v'), withFlag=False):
+    def textrank(self, sentence, topK=20, withWeight=False, allowPOS=('ns', 'n', 'vn', 'v'), withFlag=False, beam_width=None):
         """
         Extract keywords from sentence using TextRank algorithm.
         Parameter:
@@ -77,11 +79,16 @@ class TextRank(KeywordExtractor):
                         if the POS of w is not in this list, it will be filtered.
             - withFlag: if True, return a list of pair(word, weight) like posseg.cut
                         if False, return a list of words
+            - beam_width: states kept per character when tagging unknown
+                          words, see POSTokenizer.cut; defaults to
+                          self.beam_width (None: exact).
         """
         self.pos_filt = frozenset(allowPOS)
         g = UndirectWeightedGraph()
         cm = defaultdict(int)
-        words = tuple(self.tokenizer.cut(sentence))
+        if beam_width is None:
+            beam_width = self.beam_width
+        words = tuple(self.tokenizer.cut(sentence, beam_width=beam_width))
         for i, wp in enumerate(words):
             if self.pairfilter(wp):
                 for j in xrange(i + 1, i + self.span):
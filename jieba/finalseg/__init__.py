@@ -3,13 +3,27 @@ import re
 import os
 import sys
 import pickle
+import weakref
+import threading
 from .._compat import *
+from ..hmm import HMMModel, load_shared_model
+from ..lru import LRUCache
+
+# NumPy, imported by import_numpy when a NumPy decoder is first used; the
+# default decoder does without it. False when it is not installed.
+numpy = None
 
 MIN_FLOAT = -3.14e100
+# number of decoded blocks kept in memo
+MEMO_SIZE = 20000
+# decode_batch vectorizes groups of at least this many sequences of the
+# same length; smaller groups are decoded one by one
+BATCH_MIN_GROUP = 16
 
 PROB_START_P = "prob_start.p"
 PROB_TRANS_P = "prob_trans.p"
 PROB_EMIT_P = "prob_emit.p"
+HMM_MODEL = "hmm_model.bin"
 
 
 PrevStatus = {
@@ -19,19 +33,116 @@ PrevStatus = {
     'E': 'BM'
 }
 
-Force_Split_Words = set([])
+# integer encoding of the states used by the decoders and __cut, in label
+# order so that comparing ids breaks ties like comparing labels
+B, E, M, S = 0, 1, 2, 3
+STATES = 'BEMS'
+STATE_ID = dict((y, i) for i, y in enumerate(STATES))
+
 def load_model():
     start_p = pickle.load(get_module_res("finalseg", PROB_START_P))
     trans_p = pickle.load(get_module_res("finalseg", PROB_TRANS_P))
     emit_p = pickle.load(get_module_res("finalseg", PROB_EMIT_P))
     return start_p, trans_p, emit_p
 
-if sys.platform.startswith("java"):
-    start_P, trans_P, emit_P = load_model()
-else:
-    from .prob_start import P as start_P
-    from .prob_trans import P as trans_P
-    from .prob_emit import P as emit_P
+
+def load_source_model():
+    if sys.platform.startswith("java"):
+        start_p, trans_p, emit_p = load_model()
+    else:
+        from .prob_start import P as start_p
+        from .prob_trans import P as trans_p
+        from .prob_emit import P as emit_p
+    return HMMModel.from_dicts(start_p, trans_p, emit_p, dense=True)
+
+
+_hmm_model = None
+_hmm_model_lock = threading.Lock()
+
+
+def get_hmm_model():
+    """
+    Return the BMES HMM, loading it on first use.
+
+    The tables, with the dense emission matrix, are memory-mapped from
+    the binary model file; the dict tables in the package sources are
+    only used if it cannot be read.
+    """
+    global _hmm_model
+    if _hmm_model is None:
+        with _hmm_model_lock:
+            if _hmm_model is None:
+                path = os.path.join(os.path.dirname(os.path.abspath(__file__)), HMM_MODEL)
+                try:
+                    model = HMMModel.load(path)
+                    dense_emit(model)
+                    _hmm_model = model
+                except (IOError, OSError, ValueError):
+                    _hmm_model = load_source_model()
+    return _hmm_model
+
+
+def load_hmm_model(path):
+    """
+    Return the model in the binary file `path`, shared with the other
+    users of the same file.
+    """
+    model = load_shared_model(path)
+    dense_emit(model)
+    return model
+
+
+def dense_emit(model):
+    """
+    Return the dense emission matrix of `model`, building it first for
+    models made without one (from_dicts, or files without it).
+    """
+    if model.emit_dense is None:
+        model.build_dense_emit()
+    return model.emit_dense
+
+
+# decoder tables of every model, built on first use
+_model_tables = weakref.WeakKeyDictionary()
+
+
+def get_tables(cls, model=None):
+    """
+    Return the `cls` tables (BackpointerTables, NumpyTables or
+    DictTables) of `model`, or of the bundled model if None.
+    """
+    if model is None:
+        model = get_hmm_model()
+    tables = _model_tables.setdefault(model, {})
+    t = tables.get(cls)
+    if t is None:
+        t = tables[cls] = cls(model)
+    return t
+
+
+class DictTables(object):
+    """
+    The nested dict tables of the sources, for viterbi().
+    """
+
+    def __init__(self, model):
+        self.start_p, self.trans_p, self.emit_p, _ = model.to_dicts()
+
+
+def get_dict_tables():
+    """
+    Return (start_P, trans_P, emit_P) of the bundled model as nested dicts.
+    """
+    t = get_tables(DictTables)
+    return t.start_p, t.trans_p, t.emit_p
+
+
+def __getattr__(name):
+    # start_P, trans_P and emit_P used to be loaded at import time; build
+    # them from the model when asked for (Python 3.7+)
+    if name not in ('start_P', 'trans_P', 'emit_P'):
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    return dict(zip(('start_P', 'trans_P', 'emit_P'), get_dict_tables()))[name]
 
 # 维特比算法
 def viterbi(obs, states, start_p, trans_p, emit_p):
@@ -59,47 +170,396 @@ def viterbi(obs, states, start_p, trans_p, emit_p):
 
     return (prob, path[state])
 
-# HMM标注切词
-def __cut(sentence):
-    global emit_P
-    prob, pos_list = viterbi(sentence, 'BMES', start_P, trans_P, emit_P)
-    # 输出 pos_list: ['B', 'M', 'E', 'B', 'M', 'E', 'S', 'S']格式用于切词
+def import_numpy():
+    """
+    Return the numpy module, importing it on first use, or None if NumPy
+    is not installed.
+    """
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            module = False
+        numpy = module
+    return numpy or None
+
+
+class NumpyTables(object):
+    """
+    Dense float arrays of the HMM for viterbi_numpy.
+
+    States are numbered in reverse label order (S, M, E, B), so that
+    argmax, which returns the first maximum, breaks ties towards the
+    larger label as max() over (prob, state) tuples does. Transitions
+    outside PrevStatus are -inf; emit is the dense emission matrix of
+    the model with its columns in this order.
+    """
+    states = 'SMEB'
+
+    def __init__(self, model):
+        import_numpy()
+        states = self.states
+        state_id = dict((y, i) for i, y in enumerate(states))
+        # to the integer states shared with __cut
+        self.state_ids = [STATE_ID[y] for y in states]
+        self.start = numpy.array([model.start[STATE_ID[y]] for y in states])
+        self.trans = numpy.full((4, 4), float('-inf'))
+        for y, prev in iteritems(PrevStatus):
+            for y0 in prev:
+                self.trans[state_id[y0], state_id[y]] = model.trans[
+                    STATE_ID[y0]].get(STATE_ID[y], MIN_FLOAT)
+        self.char_id = model.char_id
+        self.unknown = len(model.chars)
+        self.emit = numpy.asarray(dense_emit(model)).reshape(-1, 4)[:, self.state_ids]
+        self.columns = numpy.arange(4)
+
+
+def viterbi_numpy(obs, model=None):
+    """
+    Same result as python_viterbi(obs, model), decoded with array
+    operations and an integer backpointer matrix.
+    """
+    tables = get_tables(NumpyTables, model)
+    trans = tables.trans
+    columns = tables.columns
+    get_id = tables.char_id.get
+    unknown = tables.unknown
+    emit = tables.emit[[get_id(ch, unknown) for ch in obs]]
+    back = numpy.zeros((len(obs), 4), dtype=numpy.intp)
+    v = tables.start + emit[0]
+    for t in xrange(1, len(obs)):
+        # scores[y0, y] = V[t - 1][y0] + trans_p[y0][y] + emit_p[y][obs[t]],
+        # summed in this order so that rounding gives the same ties
+        scores = v[:, None] + trans + emit[t]
+        best = scores.argmax(0)
+        v = scores[best, columns]
+        back[t] = best
+    # S (0) wins ties with E (2)
+    state = 0 if v[0] >= v[2] else 2
+    prob = float(v[state])
+    to_id = tables.state_ids
+    path = [None] * len(obs)
+    for t in xrange(len(obs) - 1, -1, -1):
+        path[t] = to_id[state]
+        state = back[t, state]
+    return (prob, path)
+
+
+def viterbi_numpy_batch(sequences, model=None):
+    """
+    viterbi_numpy over sequences of the same length at once, with a
+    leading batch axis on every array. Returns a list of (prob, path).
+    """
+    tables = get_tables(NumpyTables, model)
+    n, length = len(sequences), len(sequences[0])
+    get_id = tables.char_id.get
+    unknown = tables.unknown
+    ids = numpy.array([[get_id(ch, unknown) for ch in obs] for obs in sequences],
+                      dtype=numpy.intp).reshape(n, length)
+    emit = tables.emit[ids]
+    trans = tables.trans
+    back = numpy.zeros((length, n, 4), dtype=numpy.intp)
+    v = tables.start + emit[:, 0]
+    for t in xrange(1, length):
+        # same order of additions as viterbi_numpy
+        scores = v[:, :, None] + trans + emit[:, t, None, :]
+        back[t] = scores.argmax(1)
+        v = scores.max(1)
+    rows = numpy.arange(n)
+    state = numpy.where(v[:, 0] >= v[:, 2], 0, 2)
+    probs = v[rows, state]
+    path = numpy.zeros((n, length), dtype=numpy.intp)
+    for t in xrange(length - 1, -1, -1):
+        path[:, t] = state
+        state = back[t, rows, state]
+    to_id = numpy.array(tables.state_ids)[path]
+    return [(float(p), row.tolist()) for p, row in zip(probs, to_id)]
+
+
+class BackpointerTables(object):
+    """
+    The HMM for viterbi_backpointer, indexed by the integer states.
+    """
+
+    def __init__(self, model):
+        self.start = list(model.start)
+        # trans[y0][y], MIN_FLOAT where there is no transition
+        self.trans = [[model.trans[y0].get(y, MIN_FLOAT) for y in xrange(4)]
+                      for y0 in xrange(4)]
+        # emission rows of the dense matrix, row ids of the characters
+        self.emit = dense_emit(model)
+        self.char_id = model.char_id
+        self.unknown = len(model.chars)
+
+
+def viterbi_backpointer(obs, model=None):
+    """
+    Same result as python_viterbi(obs, model).
+
+    Keeps one backpointer per state and character and follows them back
+    once at the end, so time and memory are linear in len(obs) instead
+    of copying a path per state and character.
+    """
+    tables = get_tables(BackpointerTables, model)
+    emit = tables.emit
+    get_row = tables.char_id.get
+    unknown = tables.unknown
+    (_, tBE, tBM, _), (tEB, _, _, tES), (_, tME, tMM, _), (tSB, _, _, tSS) = tables.trans
+    r = get_row(obs[0], unknown) * 4
+    vB, vE, vM, vS = [p + emit[r + y] for y, p in enumerate(tables.start)]
+    # back[4 * t + y] is the state before y at t
+    back = bytearray(4 * len(obs))
+    i = 4
+    for ch in obs[1:]:
+        # PrevStatus: B <- E, S; E <- B, M; M <- B, M; S <- E, S; on equal
+        # probability the larger label wins, as with max() over tuples
+        r = get_row(ch, unknown) * 4
+        em = emit[r]
+        p0 = vE + tEB + em
+        p1 = vS + tSB + em
+        if p1 >= p0:
+            nB = p1
+            back[i] = S
+        else:
+            nB = p0
+            back[i] = E
+        em = emit[r + 1]
+        p0 = vB + tBE + em
+        p1 = vM + tME + em
+        if p1 >= p0:
+            nE = p1
+            back[i + 1] = M
+        else:
+            nE = p0
+            back[i + 1] = B
+        em = emit[r + 2]
+        p0 = vB + tBM + em
+        p1 = vM + tMM + em
+        if p1 >= p0:
+            nM = p1
+            back[i + 2] = M
+        else:
+            nM = p0
+            back[i + 2] = B
+        em = emit[r + 3]
+        p0 = vE + tES + em
+        p1 = vS + tSS + em
+        if p1 >= p0:
+            nS = p1
+            back[i + 3] = S
+        else:
+            nS = p0
+            back[i + 3] = E
+        vB, vE, vM, vS = nB, nE, nM, nS
+        i += 4
+    if vS >= vE:
+        prob, state = vS, S
+    else:
+        prob, state = vE, E
+    path = [0] * len(obs)
+    for t in xrange(len(obs) - 1, -1, -1):
+        path[t] = state
+        state = back[4 * t + state]
+    return (prob, path)
+
+
+def python_viterbi(obs, model=None):
+    """
+    viterbi(obs, 'BMES', start_P, trans_P, emit_P) with integer states.
+    """
+    t = get_tables(DictTables, model)
+    prob, path = viterbi(obs, 'BMES', t.start_p, t.trans_p, t.emit_p)
+    return (prob, [STATE_ID[y] for y in path])
+
+
+# every decoder takes (obs, model=None) and returns (prob, list of
+# integer states)
+DECODERS = {
+    'python': python_viterbi,
+    'backpointer': viterbi_backpointer,
+    'numpy': viterbi_numpy,
+}
+
+re_han = re.compile("([\u4E00-\u9FD5]+)")
+re_skip = re.compile("([a-zA-Z0-9]+(?:\.\d+)?%?)")
+
+
+def split_states(sentence, pos_list):
+    # 输出 pos_list: [B, M, E, B, M, E, S, S]（整数状态）格式用于切词
     begin, nexti = 0, 0
     # print pos_list, sentence
     for i, char in enumerate(sentence):
         pos = pos_list[i]
-        if pos == 'B':
+        if pos == B:
             begin = i
-        elif pos == 'E':
+        elif pos == E:
             yield sentence[begin:i + 1]
             nexti = i + 1
-        elif pos == 'S':
+        elif pos == S:
             yield char
             nexti = i + 1
     if nexti < len(sentence):
         yield sentence[nexti:]
 
-re_han = re.compile("([\u4E00-\u9FD5]+)")
-re_skip = re.compile("([a-zA-Z0-9]+(?:\.\d+)?%?)")
+
+class Segmenter(object):
+    """
+    HMM segmentation of Chinese text, with its own force-split words,
+    decoder and memo.
+
+    `model` is an HMMModel, the path of a binary model file, or None for
+    the bundled model. Models are read-only and shared: a model file is
+    loaded once however many segmenters use it.
+    """
+
+    def __init__(self, model=None, decoder='backpointer'):
+        # a model file is loaded on first use; its path is kept for snapshots
+        if isinstance(model, string_types):
+            self.model_path, self._model = model, None
+        else:
+            self.model_path, self._model = None, model
+        self.force_split_words = set()
+        # bumped by add_force_split, so that cached results can be dropped
+        self.force_split_version = 0
+        # block -> words decoded by cut_block; force_split_words is applied
+        # afterwards in cut, so the memo stays valid when it changes
+        self.memo = LRUCache(MEMO_SIZE)
+        self.set_decoder(decoder)
+
+    def __repr__(self):
+        return '<Segmenter model=%r decoder=%r>' % (
+            self.model_path or self._model, self.decoder_name)
+
+    @property
+    def model(self):
+        if self._model is None:
+            if self.model_path is None:
+                return get_hmm_model()
+            self._model = load_hmm_model(self.model_path)
+        return self._model
+
+    def set_decoder(self, name):
+        """
+        Select the Viterbi implementation used by cut: 'backpointer' (the
+        default), 'python' (path copying, kept for comparison) or 'numpy'.
+
+        'numpy' falls back to 'backpointer' when NumPy is not installed.
+        """
+        if name not in DECODERS:
+            raise ValueError('unknown decoder: %s' % name)
+        if name == 'numpy' and import_numpy() is None:
+            name = 'backpointer'
+        self.decoder_name = name
+        self.decoder = DECODERS[name]
+        self.memo.clear()
+
+    def decode(self, obs):
+        return self.decoder(obs, self.model)
+
+    def decode_batch(self, sequences):
+        """
+        Decode many observation sequences, returning their (prob, path)
+        in the same order; each result is the same as decode(obs).
+
+        With NumPy, sequences are grouped by length and large enough
+        groups are decoded together by viterbi_numpy_batch, so the
+        interpreter overhead is paid per character position instead of
+        per character of every sequence.
+        """
+        model = self.model
+        results = [None] * len(sequences)
+        groups = {}
+        for i, obs in enumerate(sequences):
+            groups.setdefault(len(obs), []).append(i)
+        for length, idx in iteritems(groups):
+            if len(idx) >= BATCH_MIN_GROUP and import_numpy() is not None:
+                decoded = viterbi_numpy_batch([sequences[i] for i in idx], model)
+            else:
+                decoded = [self.decoder(sequences[i], model) for i in idx]
+            for i, r in zip(idx, decoded):
+                results[i] = r
+        return results
+
+    def add_force_split(self, word):
+        self.force_split_words.add(word)
+        self.force_split_version += 1
+
+    # HMM标注切词，重复出现的未登录词直接查memo
+    def cut_block(self, sentence):
+        words = self.memo.get(sentence)
+        if words is None:
+            prob, pos_list = self.decode(sentence)
+            words = self.memo[sentence] = tuple(split_states(sentence, pos_list))
+        return words
+
+    def cut(self, sentence):
+        for word in self.cut_blocks(strdecode(sentence), self.cut_block):
+            yield word
+
+    def cut_batch(self, sentences):
+        """
+        Return [list(cut(sentence)) for sentence in sentences], decoding
+        the Chinese blocks not in memo together with decode_batch.
+        """
+        sentences = [strdecode(sentence) for sentence in sentences]
+        memo = self.memo
+        words = {}
+        pending = []
+        for sentence in sentences:
+            for blk in re_han.findall(sentence):
+                if blk not in words:
+                    words[blk] = memo.get(blk)
+                    if words[blk] is None:
+                        pending.append(blk)
+        for blk, (prob, pos_list) in zip(pending, self.decode_batch(pending)):
+            words[blk] = memo[blk] = tuple(split_states(blk, pos_list))
+        return [list(self.cut_blocks(sentence, words.__getitem__))
+                for sentence in sentences]
+
+    def cut_blocks(self, sentence, cut_block):
+        force_split_words = self.force_split_words
+        blocks = re_han.split(sentence)
+        for blk in blocks:
+            if re_han.match(blk):
+                for word in cut_block(blk):
+                    if word not in force_split_words:
+                        yield word
+                    else:
+                        for c in word:
+                            yield c
+            else:
+                tmp = re_skip.split(blk)
+                for x in tmp:
+                    if x:
+                        yield x
+
+
+# the segmenter of the module level functions and of jieba.dt
+dseg = Segmenter()
+Force_Split_Words = dseg.force_split_words
+memo = dseg.memo
+
+
+def decode(obs):
+    return dseg.decode(obs)
+
+
+def decode_batch(sequences):
+    return dseg.decode_batch(sequences)
+
+
+def set_decoder(name):
+    dseg.set_decoder(name)
 
 
 def add_force_split(word):
-    global Force_Split_Words
-    Force_Split_Words.add(word)
+    dseg.add_force_split(word)
+
 
 def cut(sentence):
-    sentence = strdecode(sentence)
-    blocks = re_han.split(sentence)
-    for blk in blocks:
-        if re_han.match(blk):
-            for word in __cut(blk):
-                if word not in Force_Split_Words:
-                    yield word
-                else:
-                    for c in word:
-                        yield c
-        else:
-            tmp = re_skip.split(blk)
-            for x in tmp:
-                if x:
-                    yield x
+    return dseg.cut(sentence)
+
+
+def cut_batch(sentences):
+    return dseg.cut_batch(sentences)
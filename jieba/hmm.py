@@ -0,0 +1,338 @@
+from __future__ import absolute_import, unicode_literals
+import os
+import mmap
+import struct
+import weakref
+import threading
+from array import array
+from ._compat import *
+
+MIN_FLOAT = -3.14e100
+
+# binary model format:
+#   header:  magic, format version, byte order mark, number of sections
+#   table:   name, typecode, offset and length of every section
+#   body:    the sections as native arrays, each aligned to 8 bytes
+MAGIC = b'JIEBAHMM'
+FORMAT_VERSION = 1
+BYTE_ORDER_MARK = 0x01020304
+_HEADER = struct.Struct('=8sIIq')
+_SECTION = struct.Struct('=8s8sqq')
+# memoryview.cast is needed to use the mapped arrays in place
+_CAN_MMAP = hasattr(memoryview, 'cast')
+
+
+def _tobytes(arr):
+    return arr.tobytes() if hasattr(arr, 'tobytes') else arr.tostring()
+
+
+def _frombytes(data, typecode):
+    arr = array(typecode)
+    if hasattr(arr, 'frombytes'):
+        arr.frombytes(data)
+    else:
+        arr.fromstring(data)
+    return arr
+
+
+def dump_sections(f, sections):
+    """
+    Write a list of (name, array) to the binary file object `f`.
+    """
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    table = []
+    for name, arr in sections:
+        offset += -offset % 8
+        nbytes = len(arr) * arr.itemsize
+        table.append((name, arr.typecode, offset, nbytes))
+        offset += nbytes
+    f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER_MARK, len(sections)))
+    for name, typecode, offset, nbytes in table:
+        f.write(_SECTION.pack(name.encode('ascii'), typecode.encode('ascii'),
+                              offset, nbytes))
+    pos = _HEADER.size + _SECTION.size * len(sections)
+    for (name, arr), (_, _, offset, nbytes) in zip(sections, table):
+        f.write(b'\0' * (offset - pos))
+        f.write(_tobytes(arr))
+        pos = offset + nbytes
+
+
+def load_sections(path):
+    """
+    Return {name: array} from a file written by `dump_sections`.
+
+    The file is memory-mapped and the arrays are used in place where the
+    interpreter allows it. Raises ValueError for files in another format.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise ValueError('truncated model file: %s' % path)
+        magic, version, bom, n_sections = _HEADER.unpack(header)
+        if (magic, version, bom) != (MAGIC, FORMAT_VERSION, BYTE_ORDER_MARK):
+            raise ValueError('incompatible model file: %s' % path)
+        table = [_SECTION.unpack(f.read(_SECTION.size))
+                 for _ in xrange(n_sections)]
+        size = os.fstat(f.fileno()).st_size
+        if any(offset + nbytes > size for _, _, offset, nbytes in table):
+            raise ValueError('truncated model file: %s' % path)
+        if _CAN_MMAP and size:
+            buf = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        else:
+            f.seek(0)
+            buf = f.read()
+    sections = {}
+    for name, typecode, offset, nbytes in table:
+        name = name.rstrip(b'\0').decode('ascii')
+        typecode = str(typecode.rstrip(b'\0').decode('ascii'))
+        if _CAN_MMAP and nbytes:
+            sections[name] = buf[offset:offset + nbytes].cast(typecode)
+        else:
+            sections[name] = _frombytes(bytes(buf[offset:offset + nbytes]), typecode)
+    return sections
+
+
+def _text(arr):
+    return _tobytes(arr).decode('utf-8')
+
+
+class HMMModel(object):
+    """
+    Compact, read-only tables of a hidden Markov model.
+
+    States are numbered in sorted order of their labels, so comparing
+    state ids breaks ties the same way as comparing labels. Characters
+    are numbered in code point order. Transitions, emissions and the
+    optional character -> allowed states table are stored as sparse
+    rows (indptr, indices, data):
+
+        trans:      row per previous state, indices are next states
+        emit:       row per character, indices are states
+        char_state: row per character, allowed states in table order
+
+    Models with few states can also keep their emissions as a dense
+    matrix, emit_dense, with a row of n_states floats per character in
+    `chars` order and a last row for unknown characters; missing entries
+    are MIN_FLOAT. The emission vector of a character is then one slice
+    away.
+
+    The reverse of the transition table, a tuple per next state of its
+    possible previous states, is built at load time for compact_viterbi.
+    Per-character rows are turned into dicts on first use only.
+    """
+
+    def __init__(self, labels, chars, start, trans_indptr, trans_indices,
+                 trans_data, emit_indptr, emit_indices, emit_data,
+                 cs_indptr=None, cs_indices=None, emit_dense=None):
+        self.labels = labels
+        self.chars = chars
+        self.char_id = dict((ch, i) for i, ch in enumerate(chars))
+        self.start = start
+        self.trans_indptr = trans_indptr
+        self.trans_indices = trans_indices
+        self.trans_data = trans_data
+        self.emit_indptr = emit_indptr
+        self.emit_indices = emit_indices
+        self.emit_data = emit_data
+        self.cs_indptr = cs_indptr
+        self.cs_indices = cs_indices
+        self.emit_dense = emit_dense
+        # trans[x] is {next state: log prob}
+        self.trans = []
+        for x in xrange(len(labels)):
+            a, b = trans_indptr[x], trans_indptr[x + 1]
+            self.trans.append(dict(zip(trans_indices[a:b], trans_data[a:b])))
+        self.build_reverse_index()
+        self._emit_rows = {}
+        self._char_states = {}
+
+    def build_reverse_index(self):
+        """
+        Build from the transition rows:
+
+            prev[y]:      ((previous state, log prob), ...) by state id
+            next_states:  frozenset of the next states of every state
+        """
+        n = len(self.labels)
+        rows = [[] for _ in xrange(n)]
+        for x in xrange(n):
+            for i in xrange(self.trans_indptr[x], self.trans_indptr[x + 1]):
+                rows[self.trans_indices[i]].append((x, self.trans_data[i]))
+        self.prev = [tuple(row) for row in rows]
+        self.next_states = [frozenset(row) for row in self.trans]
+
+    def __repr__(self):
+        return '<HMMModel states=%d chars=%d>' % (len(self.labels), len(self.chars))
+
+    @classmethod
+    def from_dicts(cls, start_p, trans_p, emit_p, char_state_tab=None, dense=False):
+        """
+        Build a model from the nested dict tables of finalseg or posseg,
+        with the dense emission matrix if `dense` is true.
+        """
+        labels = sorted(start_p)
+        state_id = dict((y, i) for i, y in enumerate(labels))
+        chars = set()
+        for row in itervalues(emit_p):
+            chars.update(row)
+        if char_state_tab:
+            chars.update(char_state_tab)
+        chars = sorted(chars)
+
+        start = array('d', [start_p[y] for y in labels])
+        trans_indptr = array('i', [0])
+        trans_indices = array('i')
+        trans_data = array('d')
+        for y in labels:
+            for y1, p in sorted(iteritems(trans_p[y]), key=lambda kv: state_id[kv[0]]):
+                trans_indices.append(state_id[y1])
+                trans_data.append(p)
+            trans_indptr.append(len(trans_indices))
+
+        by_char = dict((ch, []) for ch in chars)
+        for y in labels:
+            for ch, p in iteritems(emit_p[y]):
+                by_char[ch].append((state_id[y], p))
+        emit_indptr = array('i', [0])
+        emit_indices = array('i')
+        emit_data = array('d')
+        for ch in chars:
+            for y, p in sorted(by_char[ch]):
+                emit_indices.append(y)
+                emit_data.append(p)
+            emit_indptr.append(len(emit_indices))
+
+        cs_indptr = cs_indices = None
+        if char_state_tab:
+            cs_indptr = array('i', [0])
+            cs_indices = array('i')
+            for ch in chars:
+                cs_indices.extend(state_id[y] for y in char_state_tab.get(ch, ()))
+                cs_indptr.append(len(cs_indices))
+        model = cls(labels, ''.join(chars), start, trans_indptr, trans_indices,
+                    trans_data, emit_indptr, emit_indices, emit_data,
+                    cs_indptr, cs_indices)
+        if dense:
+            model.build_dense_emit()
+        return model
+
+    def build_dense_emit(self):
+        """
+        Fill emit_dense from the sparse emission rows.
+        """
+        n = len(self.labels)
+        dense = array('d', [MIN_FLOAT]) * ((len(self.chars) + 1) * n)
+        for i in xrange(len(self.chars)):
+            for j in xrange(self.emit_indptr[i], self.emit_indptr[i + 1]):
+                dense[i * n + self.emit_indices[j]] = self.emit_data[j]
+        self.emit_dense = dense
+
+    def dump(self, f):
+        labels = '\n'.join(
+            '\t'.join(y) if isinstance(y, tuple) else y for y in self.labels)
+        sections = [
+            ('labels', array('B', labels.encode('utf-8'))),
+            ('chars', array('B', self.chars.encode('utf-8'))),
+            ('start', self.start),
+            ('t_ptr', self.trans_indptr),
+            ('t_idx', self.trans_indices),
+            ('t_data', self.trans_data),
+            ('e_ptr', self.emit_indptr),
+            ('e_idx', self.emit_indices),
+            ('e_data', self.emit_data),
+        ]
+        if self.cs_indptr is not None:
+            sections.append(('cs_ptr', self.cs_indptr))
+            sections.append(('cs_idx', self.cs_indices))
+        if self.emit_dense is not None:
+            sections.append(('e_dense', self.emit_dense))
+        dump_sections(f, sections)
+
+    @classmethod
+    def load(cls, path):
+        s = load_sections(path)
+        labels = [tuple(y.split('\t')) if '\t' in y else y
+                  for y in _text(s['labels']).split('\n')]
+        return cls(labels, _text(s['chars']), s['start'], s['t_ptr'],
+                   s['t_idx'], s['t_data'], s['e_ptr'], s['e_idx'],
+                   s['e_data'], s.get('cs_ptr'), s.get('cs_idx'),
+                   s.get('e_dense'))
+
+    def emit_row(self, ch):
+        """
+        Return {state: log emission prob} for character `ch`.
+        """
+        row = self._emit_rows.get(ch)
+        if row is None:
+            i = self.char_id.get(ch)
+            if i is None:
+                row = {}
+            else:
+                a, b = self.emit_indptr[i], self.emit_indptr[i + 1]
+                row = dict(zip(self.emit_indices[a:b], self.emit_data[a:b]))
+            self._emit_rows[ch] = row
+        return row
+
+    def emit_offset(self, ch):
+        """
+        Return the index in emit_dense where the row of `ch` starts.
+        """
+        return self.char_id.get(ch, len(self.chars)) * len(self.labels)
+
+    def char_states(self, ch):
+        """
+        Return the states allowed for character `ch`, or None if the
+        model has no restriction for it.
+        """
+        try:
+            return self._char_states[ch]
+        except KeyError:
+            pass
+        i = self.char_id.get(ch)
+        states = None
+        if self.cs_indptr is not None and i is not None:
+            a, b = self.cs_indptr[i], self.cs_indptr[i + 1]
+            if a != b:
+                states = tuple(self.cs_indices[a:b])
+        self._char_states[ch] = states
+        return states
+
+    def to_dicts(self):
+        """
+        Return the tables as (start_p, trans_p, emit_p, char_state_tab)
+        nested dicts keyed by labels; char_state_tab is None if absent.
+        """
+        labels = self.labels
+        start_p = dict((y, self.start[i]) for i, y in enumerate(labels))
+        trans_p = dict((y, dict((labels[y1], p) for y1, p in iteritems(self.trans[i])))
+                       for i, y in enumerate(labels))
+        emit_p = dict((y, {}) for y in labels)
+        for i, ch in enumerate(self.chars):
+            for y, p in iteritems(self.emit_row(ch)):
+                emit_p[labels[y]][ch] = p
+        char_state_tab = None
+        if self.cs_indptr is not None:
+            char_state_tab = {}
+            for ch in self.chars:
+                states = self.char_states(ch)
+                if states:
+                    char_state_tab[ch] = tuple(labels[y] for y in states)
+        return start_p, trans_p, emit_p, char_state_tab
+
+
+# models loaded by load_shared_model, keyed by absolute path
+MODEL_REGISTRY = weakref.WeakValueDictionary()
+_registry_lock = threading.Lock()
+
+
+def load_shared_model(path):
+    """
+    Return HMMModel.load(path), sharing the model with the other callers
+    for the same file while it is in use.
+    """
+    path = os.path.abspath(path)
+    with _registry_lock:
+        model = MODEL_REGISTRY.get(path)
+        if model is None:
+            model = MODEL_REGISTRY[path] = HMMModel.load(path)
+    return model
@@ -0,0 +1,59 @@
+from __future__ import absolute_import, unicode_literals
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Size-bounded mapping that drops the least recently used entry.
+
+    `hits` and `misses` count the lookups done with `get`, to help
+    choosing `maxsize`.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '<LRUCache size=%d maxsize=%d hits=%d misses=%d>' % (
+            len(self.data), self.maxsize, self.hits, self.misses)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                # move to the most recently used end
+                value = self.data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data[key] = value
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def info(self):
+        """
+        Return a dict of hits, misses, size and maxsize.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.data), 'maxsize': self.maxsize}
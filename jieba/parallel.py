@@ -0,0 +1,469 @@
+from __future__ import absolute_import, unicode_literals
+import gc
+import time
+import logging
+import multiprocessing
+from array import array
+from collections import deque
+from ._compat import *
+
+# characters per task sent to the workers, at most
+CHUNK_SIZE = 1 << 16
+# smaller inputs are cut in chunks small enough to make this many tasks
+MIN_TASKS = 64
+
+# tokenizer of a worker process, built by _init_worker
+_tokenizer = None
+
+default_logger = logging.getLogger('jieba')
+
+
+def block_start(text, pattern, pos):
+    """
+    Return the first index >= `pos` where a block of `pattern` (e.g.
+    re_han_default) starts in `text`, or None.
+    """
+    m = pattern.search(text, pos)
+    if m is not None and m.start() == pos and pos > 0 and pattern.match(text, pos - 1):
+        # pos is inside a block, take the next one
+        m = pattern.search(text, m.end())
+    return None if m is None else m.start()
+
+
+def split_text(pieces, pattern, size=CHUNK_SIZE):
+    """
+    Join the text pieces of an iterable (lines of a file, or a single
+    text) and split them again into chunks of at least `size` characters.
+
+    Chunks end only where a block of `pattern` starts, so the words of
+    the chunks cut one by one are the words of the whole text, however
+    long its lines. Pieces are read as the chunks are consumed.
+    """
+    buf = []
+    length = 0
+    for piece in pieces:
+        if not piece:
+            continue
+        start = length
+        buf.append(piece)
+        length += len(piece)
+        if length <= size:
+            continue
+        # the buffer before this piece has no cut, so only the piece is
+        # searched, after the last character of the buffer; the buffer is
+        # joined once a cut is found, so a long block is not joined again
+        # for every piece
+        if start:
+            context = buf[-2][-1] + piece
+            cut = block_start(context, pattern, max(size - start, 0) + 1)
+            if cut is not None:
+                cut += start - 1
+        else:
+            cut = block_start(piece, pattern, size)
+        if cut is None:
+            continue
+        text = ''.join(buf)
+        pos = 0
+        while cut is not None:
+            yield text[pos:cut]
+            pos = cut
+            cut = block_start(text, pattern, pos + size)
+        buf = [text[pos:]]
+        length = len(text) - pos
+    if length:
+        yield ''.join(buf)
+
+
+def imap_bounded(pool, func, tasks, window):
+    """
+    Like pool.imap(func, tasks), but taking at most `window` tasks from
+    the iterable ahead of the result being yielded, so that a long
+    stream of tasks is never held in memory. Results are in task order.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def get_start_method(start_method=None):
+    """
+    Return the start method of the worker processes of a pool started
+    with `start_method`: 'fork', 'spawn' or 'forkserver'.
+
+    None means the start method set by the application, or else the
+    default of the platform. The global start method is left unset, so
+    that the application can still call multiprocessing.set_start_method.
+    """
+    if start_method is not None:
+        return start_method
+    if hasattr(multiprocessing, 'get_start_method'):
+        # get_start_method() and get_context() would fix the default
+        return (multiprocessing.get_start_method(allow_none=True) or
+                multiprocessing.get_all_start_methods()[0])
+    return 'fork'
+
+
+def start_pool(processes, initializer=None, initargs=(), start_method=None):
+    """
+    Return multiprocessing.Pool(processes, initializer, initargs), its
+    processes started with `start_method` (Python 3.4+), or the default
+    start method of multiprocessing if None. Workers log the time they
+    took to start, and to run the initializer, at debug level; they log
+    with the level of this process.
+
+    The dictionary trie, its POS tags and the HMMs are memory-mapped
+    read-only, so forked workers share their pages. The objects of this
+    process are frozen while forking (Python 3.7+): the garbage collector
+    of the workers leaves them alone instead of writing to, and so
+    copying, every page of the heap they inherit. If the application has
+    frozen its objects already, its freeze is left as it is.
+    """
+    if hasattr(multiprocessing, 'get_context'):
+        # a context of its own, so the global start method stays unset
+        context = multiprocessing.get_context(get_start_method(start_method))
+    else:
+        context = multiprocessing
+    freeze = hasattr(gc, 'freeze') and gc.get_freeze_count() == 0
+    if freeze:
+        gc.freeze()
+    try:
+        return context.Pool(processes, _start_worker, (
+            initializer, initargs, time.time(), default_logger.level))
+    finally:
+        if freeze:
+            gc.unfreeze()
+
+
+def chunk_size(text):
+    # CHUNK_SIZE, or less for texts too small to make MIN_TASKS chunks
+    return max(1, min(CHUNK_SIZE, len(text) // MIN_TASKS))
+
+
+# Workers send words back as their lengths in the text of their task, and
+# the parent process slices the words from its own copy: about a byte per
+# word in an array instead of a pickled string. The words of the accurate
+# mode and of POS tagging tile the text, so their lengths are enough.
+
+def packed(values, signed=False):
+    """
+    Return the ints `values` in an array of the smallest typecode that
+    holds them: 'B', 'H', 'I' or 'L' ('b', 'h', ... if `signed`).
+    """
+    for typecode in ('bhil' if signed else 'BHIL'):
+        try:
+            return array(typecode, values)
+        except OverflowError:
+            pass
+    raise OverflowError("jieba: values too large to pack")
+
+
+def cut_lengths(tokenizer, text, HMM=True):
+    """
+    Return the lengths of the words of tokenizer.cut(text, HMM=HMM),
+    packed.
+    """
+    return packed([len(w) for w in tokenizer.cut(text, HMM=HMM)])
+
+
+def search_spans(tokenizer, text, HMM=True):
+    """
+    Return the words of tokenizer.cut_for_search(text, HMM) as
+    (start deltas, lengths), packed: the start of each word relative to
+    the start of the previous one, since the words overlap.
+    """
+    deltas = []
+    lengths = []
+    last = 0
+    for w, start, end in tokenizer.tokenize(text, 'search', HMM):
+        deltas.append(start - last)
+        lengths.append(end - start)
+        last = start
+    return packed(deltas, True), packed(lengths)
+
+
+def pos_lengths(tokenizer, text, HMM=True, beam_width=None):
+    """
+    Return the words of POSTokenizer.cut(text, HMM, beam_width) as
+    (lengths, tag ids, tags), the ids packed indexes in the list of tags.
+    """
+    lengths = []
+    ids = []
+    tags = []
+    tag_id = {}
+    for p in tokenizer.cut(text, HMM, beam_width):
+        lengths.append(len(p.word))
+        i = tag_id.get(p.flag)
+        if i is None:
+            i = tag_id[p.flag] = len(tags)
+            tags.append(p.flag)
+        ids.append(i)
+    return packed(lengths), packed(ids), tags
+
+
+def cut_all_words(tokenizer, text, HMM=True):
+    # full mode drops characters and overlaps words, sent as is
+    return tokenizer.lcut(text, True, HMM)
+
+
+def words_from_lengths(text, lengths):
+    words = []
+    start = 0
+    for n in lengths:
+        words.append(text[start:start + n])
+        start += n
+    return words
+
+
+def words_from_spans(text, spans):
+    words = []
+    start = 0
+    for delta, n in zip(*spans):
+        start += delta
+        words.append(text[start:start + n])
+    return words
+
+
+def pairs_from_lengths(text, result):
+    from .posseg import pair
+    lengths, ids, tags = result
+    return [pair(w, tags[i]) for w, i in zip(words_from_lengths(text, lengths), ids)]
+
+
+def words_from_list(text, words):
+    return words
+
+
+# task name -> (result of a chunk in the worker, words of the result)
+TRANSPORTS = {
+    'cut': (cut_lengths, words_from_lengths),
+    'cut_all': (cut_all_words, words_from_list),
+    'search': (search_spans, words_from_spans),
+    'pos': (pos_lengths, pairs_from_lengths),
+}
+
+
+def _start_worker(initializer, initargs, started, log_level):
+    default_logger.setLevel(log_level)
+    t = time.time()
+    if initializer is not None:
+        initializer(*initargs)
+    default_logger.debug("Worker %s started in %.3f seconds (initialized in %.3f)." % (
+        multiprocessing.current_process().name, time.time() - started, time.time() - t))
+
+
+def _init_worker(pos, state):
+    global _tokenizer
+    if pos:
+        from .posseg import POSTokenizer
+        _tokenizer = POSTokenizer.from_snapshot(state)
+    else:
+        from . import Tokenizer
+        _tokenizer = Tokenizer.from_snapshot(state)
+
+
+def _init_globals(pos_state, state=None):
+    # the global tokenizers used by enable_parallel, in a worker that did
+    # not inherit them; `state` is None if jieba.dt is the tokenizer of
+    # posseg.dt
+    import jieba
+    from . import posseg
+    posseg.dt = posseg.POSTokenizer.from_snapshot(pos_state)
+    if state is None:
+        jieba.dt = posseg.dt.tokenizer
+    else:
+        jieba.dt = jieba.Tokenizer.from_snapshot(state)
+
+
+def _run(task):
+    name, text, args = task
+    return TRANSPORTS[name][0](_tokenizer, text, *args)
+
+
+class ParallelTokenizer(object):
+    """
+    Run the cuts of a Tokenizer or POSTokenizer on a pool of worker
+    processes. The input is sent to the workers in chunks split at the
+    start of Chinese blocks (see split_text), so the words are the same
+    as those of the tokenizer.
+
+    Every worker rebuilds the tokenizer from its snapshot: the same
+    dictionary, memory-mapped from its cache file, with the same user
+    words, tags and force-split words. Workers need not inherit anything
+    from this process, so any `start_method` of multiprocessing works:
+    'fork', or 'spawn' and 'forkserver', which are safe in threaded
+    programs. If the tokenizer changes afterwards, the pool is restarted
+    with a new snapshot on the next call.
+
+    Use close(), or the object as a context manager, to stop the pool.
+    """
+
+    def __init__(self, tokenizer=None, processes=None, start_method=None):
+        from . import dt
+        from .posseg import POSTokenizer
+        self.tokenizer = tokenizer or dt
+        self.pos = isinstance(self.tokenizer, POSTokenizer)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.start_method = start_method
+        self.pool = None
+        self.pool_version = None
+
+    def __repr__(self):
+        return '<ParallelTokenizer tokenizer=%r processes=%d start_method=%s>' % (
+            self.tokenizer, self.processes, get_start_method(self.start_method))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def version(self):
+        tk = self.tokenizer.tokenizer if self.pos else self.tokenizer
+        tk.check_initialized()
+        return (tk.dict_version, tk.segmenter.force_split_version,
+                tk.segmenter.decoder_name)
+
+    def get_pool(self):
+        """
+        Return the worker pool, started with a snapshot of the current
+        state of the tokenizer.
+        """
+        version = self.version()
+        if self.pool is None or self.pool_version != version:
+            self.close()
+            self.pool = start_pool(
+                self.processes, _init_worker,
+                (self.pos, self.tokenizer.snapshot()), self.start_method)
+            self.pool_version = version
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def pattern(self, name):
+        # the blocks of the input cut independently by task `name`
+        if name == 'pos':
+            from .posseg import re_han_internal
+            return re_han_internal
+        from . import re_han_default, re_han_cut_all
+        if name == 'cut_all':
+            return re_han_cut_all
+        return re_han_default
+
+    def map_chunks(self, name, sentence, *args):
+        """
+        Return the chunks of `sentence` and their results of task `name`
+        (see TRANSPORTS) from the workers.
+        """
+        sentence = strdecode(sentence)
+        chunks = list(split_text([sentence], self.pattern(name), chunk_size(sentence)))
+        return chunks, self.get_pool().map(_run, [(name, chunk, args) for chunk in chunks])
+
+    def imap_chunks(self, name, lines, *args):
+        """
+        Yield the chunks of the iterable `lines` and their results of task
+        `name` as they complete, in order, with at most two chunks per
+        process read ahead.
+        """
+        chunks = split_text((strdecode(line) for line in lines), self.pattern(name))
+        pending = deque()
+
+        def tasks():
+            for chunk in chunks:
+                pending.append(chunk)
+                yield (name, chunk, args)
+
+        for result in imap_bounded(self.get_pool(), _run, tasks(), 2 * self.processes):
+            yield pending.popleft(), result
+
+    def cut_task(self, *args, **kwargs):
+        # task and arguments of cut(sentence, *args, **kwargs)
+        if self.pos:
+            return ('pos',) + self._pos_args(*args, **kwargs)
+        cut_all, HMM = self._cut_args(*args, **kwargs)
+        return ('cut_all' if cut_all else 'cut', HMM)
+
+    def cut(self, sentence, *args, **kwargs):
+        """
+        Same as the cut of the tokenizer: (sentence, cut_all=False,
+        HMM=True) for a Tokenizer, (sentence, HMM=True, beam_width=None)
+        for a POSTokenizer.
+        """
+        task = self.cut_task(*args, **kwargs)
+        words = TRANSPORTS[task[0]][1]
+        for chunk, result in zip(*self.map_chunks(*task[:1] + (sentence,) + task[1:])):
+            for w in words(chunk, result):
+                yield w
+
+    def lcut(self, *args, **kwargs):
+        return list(self.cut(*args, **kwargs))
+
+    def cut_lines(self, lines, *args, **kwargs):
+        """
+        Same as cut(), over an iterable of lines such as a file, read as
+        the words are consumed: memory does not grow with the input.
+        """
+        task = self.cut_task(*args, **kwargs)
+        words = TRANSPORTS[task[0]][1]
+        for chunk, result in self.imap_chunks(*task[:1] + (lines,) + task[1:]):
+            for w in words(chunk, result):
+                yield w
+
+    def cut_for_search(self, sentence, HMM=True):
+        if self.pos:
+            raise NotImplementedError
+        for chunk, spans in zip(*self.map_chunks('search', sentence, HMM)):
+            for w in words_from_spans(chunk, spans):
+                yield w
+
+    def lcut_for_search(self, *args, **kwargs):
+        return list(self.cut_for_search(*args, **kwargs))
+
+    def cut_for_search_lines(self, lines, HMM=True):
+        """
+        Same as cut_for_search(), over an iterable of lines, see cut_lines.
+        """
+        if self.pos:
+            raise NotImplementedError
+        for chunk, spans in self.imap_chunks('search', lines, HMM):
+            for w in words_from_spans(chunk, spans):
+                yield w
+
+    def tokenize(self, unicode_sentence, mode="default", HMM=True):
+        """
+        Same as Tokenizer.tokenize, yields tuples of (word, start, end).
+        """
+        if self.pos:
+            raise NotImplementedError
+        if not isinstance(unicode_sentence, text_type):
+            raise ValueError("jieba: the input parameter should be unicode.")
+        offset = 0
+        if mode == 'default':
+            for chunk, lengths in zip(*self.map_chunks('cut', unicode_sentence, HMM)):
+                start = 0
+                for n in lengths:
+                    yield (chunk[start:start + n], offset + start, offset + start + n)
+                    start += n
+                offset += len(chunk)
+        else:
+            for chunk, spans in zip(*self.map_chunks('search', unicode_sentence, HMM)):
+                start = offset
+                for delta, n in zip(*spans):
+                    start += delta
+                    yield (chunk[start - offset:start - offset + n], start, start + n)
+                offset += len(chunk)
+
+    @staticmethod
+    def _cut_args(cut_all=False, HMM=True):
+        return (cut_all, HMM)
+
+    @staticmethod
+    def _pos_args(HMM=True, beam_width=None):
+        return (HMM, beam_width)
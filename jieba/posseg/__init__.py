@@ -4,13 +4,19 @@ import re
 import sys
 import jieba
 import pickle
+import weakref
+import threading
+from functools import partial
 from .._compat import *
-from .viterbi import viterbi
+from ..hmm import HMMModel, load_shared_model
+from ..parallel import pos_lengths, pairs_from_lengths
+from .viterbi import compact_viterbi, compact_viterbi_batch
 
 PROB_START_P = "prob_start.p"
 PROB_TRANS_P = "prob_trans.p"
 PROB_EMIT_P = "prob_emit.p"
 CHAR_STATE_TAB_P = "char_state_tab.p"
+HMM_MODEL = "hmm_model.bin"
 
 re_han_detail = re.compile("([\u4E00-\u9FD5]+)")
 re_skip_detail = re.compile("([\.0-9]+|[a-zA-Z0-9]+)")
@@ -32,13 +38,140 @@ def load_model():
     return state, start_p, trans_p, emit_p
 
 
-if sys.platform.startswith("java"):
-    char_state_tab_P, start_P, trans_P, emit_P = load_model()
-else:
-    from .char_state_tab import P as char_state_tab_P
-    from .prob_start import P as start_P
-    from .prob_trans import P as trans_P
-    from .prob_emit import P as emit_P
+def load_source_model():
+    if sys.platform.startswith("java"):
+        char_state_tab_p, start_p, trans_p, emit_p = load_model()
+    else:
+        from .char_state_tab import P as char_state_tab_p
+        from .prob_start import P as start_p
+        from .prob_trans import P as trans_p
+        from .prob_emit import P as emit_p
+    return HMMModel.from_dicts(start_p, trans_p, emit_p, char_state_tab_p)
+
+
+_hmm_model = None
+_hmm_model_lock = threading.Lock()
+
+
+def get_hmm_model():
+    """
+    Return the POS tagging HMM, loading it on first use.
+
+    The tables are memory-mapped from the compact binary model file;
+    the dict tables in the package sources are only used if it cannot
+    be read.
+    """
+    global _hmm_model
+    if _hmm_model is None:
+        with _hmm_model_lock:
+            if _hmm_model is None:
+                path = os.path.join(os.path.dirname(os.path.abspath(__file__)), HMM_MODEL)
+                try:
+                    _hmm_model = HMMModel.load(path)
+                except (IOError, OSError, ValueError):
+                    jieba.default_logger.debug(
+                        "Cannot load %s, building the POS model from the sources." % path)
+                    _hmm_model = load_source_model()
+    return _hmm_model
+
+
+def __getattr__(name):
+    # char_state_tab_P, start_P, trans_P and emit_P used to be loaded at
+    # import time; build them from the model when asked for (Python 3.7+)
+    names = ('start_P', 'trans_P', 'emit_P', 'char_state_tab_P')
+    if name not in names:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    tables = dict(zip(names, get_hmm_model().to_dicts()))
+    globals().update(tables)
+    return tables[name]
+
+
+class WordTagDict(dict):
+    # a plain dict cannot be weakly referenced
+    pass
+
+
+class TrieWordTags(object):
+    """
+    Read-only word -> POS tag mapping of the tags stored in the
+    dictionary trie, memory-mapped from its cache file like the rest of
+    the trie, so processes share it.
+    """
+
+    def __init__(self, trie):
+        self.trie = trie
+
+    def __repr__(self):
+        return '<TrieWordTags trie=%r>' % self.trie
+
+    def __contains__(self, word):
+        return self.trie.get_tag(word) is not None
+
+    def __getitem__(self, word):
+        tag = self.trie.get_tag(word)
+        if tag is None:
+            raise KeyError(word)
+        return tag
+
+    def __len__(self):
+        return sum(1 for _ in self.trie.tag_items())
+
+    def __iter__(self):
+        for word, _ in self.trie.tag_items():
+            yield word
+
+    def get(self, word, default=None):
+        return self.trie.get_tag(word, default)
+
+
+# word tag tables shared by the POSTokenizers whose tokenizers load the same
+# dictionary, keyed by Tokenizer.get_dict_identity()
+WORD_TAG_REGISTRY = weakref.WeakValueDictionary()
+
+
+class WordTagTab(object):
+    """
+    Word -> POS tag mapping of a POSTokenizer.
+
+    Lookups go to a shared read-only table loaded from the dictionary;
+    tags of user words are kept per instance.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.overlay = {}
+
+    def __repr__(self):
+        return '<WordTagTab base=%d overlay=%d>' % (len(self.base), len(self.overlay))
+
+    def __contains__(self, word):
+        return word in self.overlay or word in self.base
+
+    def __getitem__(self, word):
+        if word in self.overlay:
+            return self.overlay[word]
+        return self.base[word]
+
+    def __setitem__(self, word, tag):
+        self.overlay[word] = tag
+
+    def __len__(self):
+        return len(self.base) + sum(1 for k in self.overlay if k not in self.base)
+
+    def __iter__(self):
+        for k in self.base:
+            yield k
+        for k in self.overlay:
+            if k not in self.base:
+                yield k
+
+    def get(self, word, default=None):
+        if word in self.overlay:
+            return self.overlay[word]
+        return self.base.get(word, default)
+
+    def update(self, other):
+        self.overlay.update(other)
 
 
 class pair(object):
@@ -77,9 +210,18 @@ class pair(object):
 
 class POSTokenizer(object):
 
-    def __init__(self, tokenizer=None):
+    def __init__(self, tokenizer=None, beam_width=None, hmm_model=None):
         self.tokenizer = tokenizer or jieba.Tokenizer()
-        self.load_word_tag(self.tokenizer.get_dict_file())
+        # number of states kept per character by the HMM, None for all
+        self.beam_width = beam_width
+        # an HMMModel, the path of a binary model file or None for the
+        # bundled one; model files are shared read-only, see hmm_model
+        if isinstance(hmm_model, string_types):
+            self.hmm_model_path, self._hmm_model = hmm_model, None
+        else:
+            self.hmm_model_path, self._hmm_model = None, hmm_model
+        # loaded on first use, see word_tag_tab
+        self._word_tag_tab = None
 
     def __repr__(self):
         return '<POSTokenizer tokenizer=%r>' % self.tokenizer
@@ -92,10 +234,60 @@ class POSTokenizer(object):
 
     def initialize(self, dictionary=None):
         self.tokenizer.initialize(dictionary)
-        self.load_word_tag(self.tokenizer.get_dict_file())
+        self.load_shared_word_tag()
+
+    @property
+    def word_tag_tab(self):
+        if self._word_tag_tab is None:
+            self.load_shared_word_tag()
+        return self._word_tag_tab
+
+    @word_tag_tab.setter
+    def word_tag_tab(self, value):
+        self._word_tag_tab = value
+
+    def snapshot(self):
+        """
+        Return the configuration of the POS tokenizer as a picklable
+        dict, see jieba.Tokenizer.snapshot.
+        """
+        self.makesure_userdict_loaded()
+        if self._hmm_model is not None and self.hmm_model_path is None:
+            raise ValueError("jieba: only HMM models given by path can be snapshotted")
+        return {
+            'tokenizer': self.tokenizer.snapshot(),
+            'beam_width': self.beam_width,
+            'hmm_model': self.hmm_model_path,
+            'word_tags': dict(self.word_tag_tab.overlay),
+        }
+
+    @classmethod
+    def from_snapshot(cls, state):
+        ptk = cls(jieba.Tokenizer.from_snapshot(state['tokenizer']),
+                  state['beam_width'], state['hmm_model'])
+        ptk.load_shared_word_tag()
+        ptk.word_tag_tab.overlay.update(state['word_tags'])
+        return ptk
+
+    @property
+    def hmm_model(self):
+        if self._hmm_model is None:
+            if self.hmm_model_path is None:
+                return get_hmm_model()
+            self._hmm_model = load_shared_model(self.hmm_model_path)
+        return self._hmm_model
+
+    def load_shared_word_tag(self):
+        # the tags of the dictionary are stored in its trie
+        self.tokenizer.check_initialized()
+        identity = self.tokenizer.get_dict_identity()
+        base = WORD_TAG_REGISTRY.get(identity)
+        if base is None:
+            base = WORD_TAG_REGISTRY[identity] = TrieWordTags(self.tokenizer.FREQ.trie)
+        self.word_tag_tab = WordTagTab(base)
 
     def load_word_tag(self, f):
-        self.word_tag_tab = {}
+        self.word_tag_tab = WordTagTab(WordTagDict())
         f_name = resolve_filename(f)
         for lineno, line in enumerate(f, 1):
             try:
@@ -103,7 +295,7 @@ class POSTokenizer(object):
                 if not line:
                     continue
                 word, _, tag = line.split(" ")
-                self.word_tag_tab[word] = tag
+                self.word_tag_tab.base[word] = tag
             except Exception:
                 raise ValueError(
                     'invalid POS dictionary entry in %s at Line %s: %s' % (f_name, lineno, line))
@@ -114,9 +306,11 @@ class POSTokenizer(object):
             self.word_tag_tab.update(self.tokenizer.user_word_tag_tab)
             self.tokenizer.user_word_tag_tab = {}
 
-    def __cut(self, sentence):
-        prob, pos_list = viterbi(
-            sentence, char_state_tab_P, start_P, trans_P, emit_P)
+    def __cut(self, sentence, beam_width=None):
+        prob, pos_list = compact_viterbi(sentence, self.hmm_model, beam_width)
+        return self.__tag(sentence, pos_list)
+
+    def __tag(self, sentence, pos_list):
         begin, nexti = 0, 0
 
         for i, char in enumerate(sentence):
@@ -132,11 +326,16 @@ class POSTokenizer(object):
         if nexti < len(sentence):
             yield pair(sentence[nexti:], pos_list[nexti][1])
 
-    def __cut_detail(self, sentence):
+    def __cut_detail(self, sentence, beam_width=None, decoded=None):
+        # decoded: block -> (prob, pos_list) decoded beforehand, see cut_batch
         blocks = re_han_detail.split(sentence)
         for blk in blocks:
             if re_han_detail.match(blk):
-                for word in self.__cut(blk):
+                if decoded is None:
+                    words = self.__cut(blk, beam_width)
+                else:
+                    words = self.__tag(blk, decoded[blk][1])
+                for word in words:
                     yield word
             else:
                 tmp = re_skip_detail.split(blk)
@@ -149,15 +348,13 @@ class POSTokenizer(object):
                         else:
                             yield pair(x, 'x')
 
-    def __cut_DAG_NO_HMM(self, sentence):
-        DAG = self.tokenizer.get_DAG(sentence)
-        route = {}
-        self.tokenizer.calc(sentence, DAG, route)
+    def __cut_DAG_NO_HMM(self, sentence, paths=None, beam_width=None):
+        ends = self.tokenizer.best_path(sentence, paths)
         x = 0
         N = len(sentence)
         buf = ''
         while x < N:
-            y = route[x][1] + 1
+            y = ends[x]
             l_word = sentence[x:y]
             if re_eng1.match(l_word):
                 buf += l_word
@@ -172,17 +369,22 @@ class POSTokenizer(object):
             yield pair(buf, 'eng')
             buf = ''
 
-    def __cut_DAG(self, sentence):
-        DAG = self.tokenizer.get_DAG(sentence)
-        route = {}
+    def __cut_OOV(self, buf, beam_width=None, pending=None):
+        # with `pending`, record buf and leave None in its place, as in
+        # Tokenizer.cut_batch
+        if pending is None:
+            return self.__cut_detail(buf, beam_width)
+        pending.append(buf)
+        return (None,)
 
-        self.tokenizer.calc(sentence, DAG, route)
+    def __cut_DAG(self, sentence, paths=None, beam_width=None, pending=None):
+        ends = self.tokenizer.best_path(sentence, paths)
 
         x = 0
         buf = ''
         N = len(sentence)
         while x < N:
-            y = route[x][1] + 1
+            y = ends[x]
             l_word = sentence[x:y]
             if y - x == 1:
                 buf += l_word
@@ -191,7 +393,7 @@ class POSTokenizer(object):
                     if len(buf) == 1:
                         yield pair(buf, self.word_tag_tab.get(buf, 'x'))
                     elif not self.tokenizer.FREQ.get(buf):
-                        recognized = self.__cut_detail(buf)
+                        recognized = self.__cut_OOV(buf, beam_width, pending)
                         for t in recognized:
                             yield t
                     else:
@@ -205,25 +407,30 @@ class POSTokenizer(object):
             if len(buf) == 1:
                 yield pair(buf, self.word_tag_tab.get(buf, 'x'))
             elif not self.tokenizer.FREQ.get(buf):
-                recognized = self.__cut_detail(buf)
+                recognized = self.__cut_OOV(buf, beam_width, pending)
                 for t in recognized:
                     yield t
             else:
                 for elem in buf:
                     yield pair(elem, self.word_tag_tab.get(elem, 'x'))
 
-    def __cut_internal(self, sentence, HMM=True):
+    def __cut_internal(self, sentence, HMM=True, beam_width=None, pending=None):
+        if beam_width is None:
+            beam_width = self.beam_width
         self.makesure_userdict_loaded()
         sentence = strdecode(sentence)
         blocks = re_han_internal.split(sentence)
-        if HMM:
+        if pending is not None:
+            cut_blk = partial(self.__cut_DAG, pending=pending)
+        elif HMM:
             cut_blk = self.__cut_DAG
         else:
             cut_blk = self.__cut_DAG_NO_HMM
+        paths = jieba.PathBuffer()
 
         for blk in blocks:
             if re_han_internal.match(blk):
-                for word in cut_blk(blk):
+                for word in cut_blk(blk, paths, beam_width):
                     yield word
             else:
                 tmp = re_skip_internal.split(blk)
@@ -239,19 +446,56 @@ class POSTokenizer(object):
                             else:
                                 yield pair(xx, 'x')
 
-    def _lcut_internal(self, sentence):
-        return list(self.__cut_internal(sentence))
+    def _lcut_internal(self, sentence, beam_width=None):
+        return list(self.__cut_internal(sentence, beam_width=beam_width))
 
     def _lcut_internal_no_hmm(self, sentence):
         return list(self.__cut_internal(sentence, False))
 
-    def cut(self, sentence, HMM=True):
-        for w in self.__cut_internal(sentence, HMM=HMM):
+    def cut(self, sentence, HMM=True, beam_width=None):
+        """
+        Cut `sentence` into pair(word, flag).
+
+        `beam_width` limits the states the HMM keeps per character for
+        unknown words, trading some accuracy for speed; None means the
+        exact decoding, or the beam width of the POSTokenizer if set.
+        """
+        for w in self.__cut_internal(sentence, HMM=HMM, beam_width=beam_width):
             yield w
 
     def lcut(self, *args, **kwargs):
         return list(self.cut(*args, **kwargs))
 
+    def cut_batch(self, texts, HMM=True, flat=False):
+        """
+        Tag many texts in one call, as `lcut` on each of them.
+
+        Duplicate texts are tagged once, and with the HMM the unknown
+        words of all the texts are decoded together by
+        compact_viterbi_batch. Returns a list of pair lists, or with
+        `flat=True` a pair (pairs, offsets), see Tokenizer.cut_batch.
+        """
+        self.tokenizer.check_initialized()
+        if not HMM:
+            return jieba._cut_batch(texts, self._lcut_internal_no_hmm, flat)
+        return jieba._cut_batch(texts, self.__cut_deferred, flat, self.__decode_pending)
+
+    def __cut_deferred(self, text):
+        # (pairs with None in place of the unknown words, their buffers)
+        pending = []
+        return list(self.__cut_internal(text, pending=pending)), pending
+
+    def __decode_pending(self, results):
+        bufs = set(buf for words, pending in itervalues(results) for buf in pending)
+        blocks = [blk for buf in bufs for blk in re_han_detail.findall(buf)]
+        decoded = dict(zip(blocks, compact_viterbi_batch(
+            blocks, self.hmm_model, self.beam_width)))
+        segmented = dict((buf, list(self.__cut_detail(buf, decoded=decoded)))
+                         for buf in bufs)
+        for text in results:
+            words, pending = results[text]
+            results[text] = jieba._fill_pending(words, pending, segmented)
+
 # default Tokenizer instance
 
 dt = POSTokenizer(jieba.dt)
@@ -261,15 +505,19 @@ dt = POSTokenizer(jieba.dt)
 initialize = dt.initialize
 
 
-def _lcut_internal(s):
-    return dt._lcut_internal(s)
+def _lcut_internal(s, beam_width=None):
+    return dt._lcut_internal(s, beam_width)
 
 
 def _lcut_internal_no_hmm(s):
     return dt._lcut_internal_no_hmm(s)
 
 
-def cut(sentence, HMM=True):
+def _pos_lengths(s, HMM=True, beam_width=None):
+    return pos_lengths(dt, s, HMM, beam_width)
+
+
+def cut(sentence, HMM=True, beam_width=None):
     """
     Global `cut` function that supports parallel processing.
 
@@ -278,18 +526,19 @@ def cut(sentence, HMM=True):
     """
     global dt
     if jieba.pool is None:
-        for w in dt.cut(sentence, HMM=HMM):
+        for w in dt.cut(sentence, HMM=HMM, beam_width=beam_width):
             yield w
     else:
-        parts = strdecode(sentence).splitlines(True)
-        if HMM:
-            result = jieba.pool.map(_lcut_internal, parts)
-        else:
-            result = jieba.pool.map(_lcut_internal_no_hmm, parts)
-        for r in result:
-            for w in r:
+        chunks, result = jieba._pmap(partial(_pos_lengths, HMM=HMM, beam_width=beam_width),
+                                     sentence, re_han_internal)
+        for chunk, r in zip(chunks, result):
+            for w in pairs_from_lengths(chunk, r):
                 yield w
 
 
-def lcut(sentence, HMM=True):
-    return list(cut(sentence, HMM))
+def lcut(sentence, HMM=True, beam_width=None):
+    return list(cut(sentence, HMM, beam_width))
+
+
+def cut_batch(texts, HMM=True, flat=False):
+    return dt.cut_batch(texts, HMM, flat)
@@ -51,3 +51,88 @@ def viterbi(obs, states, start_p, trans_p, emit_p):
         state = mem_path[i][state]
         i -= 1
     return (prob, route)
+
+
+def compact_viterbi(obs, model, beam_width=None):
+    """
+    Same as viterbi(), over the tables of a jieba.hmm.HMMModel.
+
+    States are handled as integer ids and mapped back to their labels
+    for the returned route. Each state is reached only from the previous
+    states that have a transition to it, taken from the reverse index of
+    the model. With `beam_width`, only that many of the most probable
+    states of each step are extended to the next one; the result is then
+    approximate.
+    """
+    V = [{}]  # tabular
+    mem_path = [{}]
+    prev = model.prev
+    next_states = model.next_states
+    all_states = xrange(len(model.labels))
+    emit = model.emit_row(obs[0])
+    for y in model.char_states(obs[0]) or all_states:  # init
+        V[0][y] = model.start[y] + emit.get(y, MIN_FLOAT)
+        mem_path[0][y] = -1
+    for t in xrange(1, len(obs)):
+        V.append({})
+        mem_path.append({})
+        Vp = V[t - 1]
+        prev_states = [x for x in mem_path[t - 1] if next_states[x]]
+        allowed = Vp
+        if beam_width and len(prev_states) > beam_width:
+            prev_states = get_top_states(
+                dict((x, Vp[x]) for x in prev_states), beam_width)
+            allowed = frozenset(prev_states)
+
+        prev_states_expect_next = set().union(
+            *[next_states[x] for x in prev_states])
+        obs_states = set(
+            model.char_states(obs[t]) or all_states) & prev_states_expect_next
+
+        if not obs_states:
+            obs_states = prev_states_expect_next if prev_states_expect_next else all_states
+
+        emit = model.emit_row(obs[t])
+        Vt = V[t]
+        mem = mem_path[t]
+        for y in obs_states:
+            em = emit.get(y, MIN_FLOAT)
+            prob = state = None
+            # predecessors come in increasing id order, so `>=` lets the
+            # larger id win ties like max() over (prob, state) pairs
+            for y0, p in prev[y]:
+                if y0 in allowed:
+                    p = Vp[y0] + p + em
+                    if state is None or p >= prob:
+                        prob, state = p, y0
+            if state is None:
+                # no previous state leads here
+                prob, state = MIN_INF, max(prev_states)
+            Vt[y] = prob
+            mem[y] = state
+
+    prob, state = max((V[-1][y], y) for y in mem_path[-1])
+
+    labels = model.labels
+    route = [None] * len(obs)
+    i = len(obs) - 1
+    while i >= 0:
+        route[i] = labels[state]
+        state = mem_path[i][state]
+        i -= 1
+    return (prob, route)
+
+
+def compact_viterbi_batch(sequences, model, beam_width=None):
+    """
+    Return [compact_viterbi(obs, model, beam_width) for obs in sequences],
+    decoding repeated sequences once.
+    """
+    decoded = {}
+    results = []
+    for obs in sequences:
+        r = decoded.get(obs)
+        if r is None:
+            r = decoded[obs] = compact_viterbi(obs, model, beam_width)
+        results.append(r)
+    return results
@@ -0,0 +1,210 @@
+"""
+Train the HMMs of finalseg and posseg from a segmented corpus.
+
+A corpus is read line by line, one sentence per line:
+
+    segmented (finalseg):   words separated by spaces
+    tagged (posseg):        word/tag pairs separated by spaces
+
+Lines are counted in chunks by worker processes, at most a few chunks
+in flight at a time, so memory only depends on the size of the counts.
+The result is written in the binary model format loaded by
+finalseg.Segmenter and posseg.POSTokenizer:
+
+    python -m jieba.train [--tagged] [-j N] -o hmm_model.bin corpus.txt ...
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+import io
+import sys
+import math
+import multiprocessing
+from argparse import ArgumentParser
+from ._compat import *
+from .hmm import HMMModel, MIN_FLOAT
+from .parallel import imap_bounded
+
+# lines per task sent to the workers
+CHUNK_LINES = 10000
+
+
+def word_states(word):
+    if len(word) == 1:
+        return 'S'
+    return 'B' + 'M' * (len(word) - 2) + 'E'
+
+
+class HMMCounts(object):
+    """
+    Start, transition and emission counts of the states of a corpus.
+    """
+
+    def __init__(self):
+        self.start = {}
+        self.trans = {}
+        self.emit = {}
+        self.lines = 0
+
+    def add(self, states, chars):
+        """
+        Count one sentence, given as its sequence of states and chars.
+        """
+        if not states:
+            return
+        self.lines += 1
+        y0 = states[0]
+        self.start[y0] = self.start.get(y0, 0) + 1
+        for y, ch in zip(states, chars):
+            row = self.emit.setdefault(y, {})
+            row[ch] = row.get(ch, 0) + 1
+        for y0, y in zip(states, states[1:]):
+            row = self.trans.setdefault(y0, {})
+            row[y] = row.get(y, 0) + 1
+
+    def update(self, other):
+        """
+        Add the counts of `other`.
+        """
+        self.lines += other.lines
+        for y, n in iteritems(other.start):
+            self.start[y] = self.start.get(y, 0) + n
+        for table, other_table in ((self.trans, other.trans), (self.emit, other.emit)):
+            for y, other_row in iteritems(other_table):
+                row = table.setdefault(y, {})
+                for k, n in iteritems(other_row):
+                    row[k] = row.get(k, 0) + n
+
+    def to_dicts(self, states):
+        """
+        Return (start_p, trans_p, emit_p) as log probabilities over
+        `states`; states never seen first in a sentence get MIN_FLOAT.
+        """
+        total = float(sum(itervalues(self.start)))
+        start_p = dict((y, math.log(self.start[y] / total) if self.start.get(y) else MIN_FLOAT)
+                       for y in states)
+        trans_p = {}
+        emit_p = {}
+        for y in states:
+            for table, probs in ((self.trans, trans_p), (self.emit, emit_p)):
+                row = table.get(y, {})
+                total = float(sum(itervalues(row)))
+                probs[y] = dict((k, math.log(n / total)) for k, n in iteritems(row))
+        return start_p, trans_p, emit_p
+
+    def to_model(self, tagged=False):
+        """
+        Return the HMMModel of the counts: the BMES model of finalseg, or
+        with `tagged` the (BMES, tag) model of posseg, whose
+        character -> states table lists the states seen with each char.
+        """
+        if not tagged:
+            return HMMModel.from_dicts(*self.to_dicts('BEMS'), dense=True)
+        states = set(self.start)
+        for y, row in iteritems(self.trans):
+            states.add(y)
+            states.update(row)
+        start_p, trans_p, emit_p = self.to_dicts(sorted(states))
+        char_state_tab = {}
+        for y, row in iteritems(self.emit):
+            for ch in row:
+                char_state_tab.setdefault(ch, []).append(y)
+        char_state_tab = dict((ch, tuple(sorted(ys))) for ch, ys in iteritems(char_state_tab))
+        return HMMModel.from_dicts(start_p, trans_p, emit_p, char_state_tab)
+
+
+def count_segmented(lines):
+    counts = HMMCounts()
+    for line in lines:
+        words = line.split()
+        counts.add(''.join(word_states(w) for w in words), ''.join(words))
+    return counts
+
+
+def count_tagged(lines):
+    counts = HMMCounts()
+    for line in lines:
+        states = []
+        chars = []
+        for token in line.split():
+            word, sep, tag = token.rpartition('/')
+            if not sep or not word:
+                word, tag = token, 'x'
+            states.extend((y, tag) for y in word_states(word))
+            chars.append(word)
+        counts.add(states, ''.join(chars))
+    return counts
+
+
+def iter_chunks(lines, size):
+    chunk = []
+    for line in lines:
+        chunk.append(strdecode(line))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_files(paths):
+    for path in paths:
+        with io.open(path, encoding='utf-8') as f:
+            for line in f:
+                yield line
+
+
+def count_corpus(lines, tagged=False, processes=None, chunk_lines=CHUNK_LINES):
+    """
+    Return the HMMCounts of an iterable of corpus lines.
+
+    With `processes` other than 1, chunks of `chunk_lines` lines are
+    counted by a pool of that many worker processes (None for the
+    number of CPUs), keeping at most two chunks per worker in flight.
+    """
+    count = count_tagged if tagged else count_segmented
+    counts = HMMCounts()
+    chunks = iter_chunks(lines, chunk_lines)
+    if processes == 1:
+        for chunk in chunks:
+            counts.update(count(chunk))
+        return counts
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in imap_bounded(pool, count, chunks, 2 * processes):
+            counts.update(result)
+    finally:
+        pool.terminate()
+    return counts
+
+
+def train(paths, output, tagged=False, processes=None, chunk_lines=CHUNK_LINES):
+    """
+    Train a model on the corpus files `paths` and write it to the file
+    `output`. Returns the HMMModel.
+    """
+    counts = count_corpus(iter_files(paths), tagged, processes, chunk_lines)
+    model = counts.to_model(tagged)
+    with open(output, 'wb') as f:
+        model.dump(f)
+    return model
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        usage="%s -m jieba.train [options] -o OUTPUT corpus ..." % sys.executable,
+        description="Train a jieba HMM from a segmented corpus.")
+    parser.add_argument("corpus", nargs='+', help="UTF-8 corpus files")
+    parser.add_argument("-o", "--output", required=True, help="model file to write")
+    parser.add_argument("-t", "--tagged", action="store_true", default=False,
+                        help="the corpus is word/tag pairs; train the POS model")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("-c", "--chunk-lines", type=int, default=CHUNK_LINES,
+                        help="lines per task (default: %d)" % CHUNK_LINES)
+    args = parser.parse_args(argv)
+    model = train(args.corpus, args.output, args.tagged, args.processes, args.chunk_lines)
+    print("%r written to %s" % (model, args.output), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,700 @@
+from __future__ import absolute_import, unicode_literals
+import os
+import mmap
+import struct
+from array import array
+from math import log
+from ._compat import *
+
+# slot that is not owned by any node
+EMPTY = -1
+
+# binary cache format:
+#   header: magic, format version, byte order mark, n_nodes, size of the
+#           arrays, number of characters, total frequency, size of the
+#           tag names
+#   body:   logfreq as native float64 array of `size` items, base, check,
+#           freq as native int32 arrays of `size` items, tag as native
+#           uint16 array of `size` items, then the characters in UTF-32-LE
+#           and the tag names, newline separated, in UTF-8
+MAGIC = b'JIEBADAT'
+FORMAT_VERSION = 4
+BYTE_ORDER_MARK = 0x01020304
+_HEADER = struct.Struct('=8sIIqqqqq')
+# memoryview.cast is needed to use the mapped arrays in place
+_CAN_MMAP = hasattr(memoryview, 'cast')
+MIN_INF = float('-inf')
+# nodes with at least this many children share one scanning position
+MAX_GROUP = 32
+
+
+def _tobytes(arr):
+    return arr.tobytes() if hasattr(arr, 'tobytes') else arr.tostring()
+
+
+def _frombytes(data, typecode='i'):
+    arr = array(typecode)
+    if hasattr(arr, 'frombytes'):
+        arr.frombytes(data)
+    else:
+        arr.fromstring(data)
+    return arr
+
+
+class DoubleArrayTrie(object):
+    """
+    Read-only double-array trie holding the prefix dictionary.
+
+    Every prefix of every word is a node. A node `s` has child `t` on
+    character code `c` iff `t == base[s] + c` and `check[t] == s`.
+    `freq[t]` is the word frequency of node `t`, 0 for pure prefixes,
+    and `logfreq[t]` its log (log(1) = 0 for pure prefixes, as in calc).
+    `tag[t]` is the POS tag of the word, as an index in `tag_names`
+    where 0 means none. The root is slot 0, and the base of any other
+    node is 0 iff it has no children.
+    """
+
+    def __init__(self, base, check, freq, chars, n_nodes, total=0, logfreq=None,
+                 tag=None, tag_names=()):
+        self.base = base
+        self.check = check
+        self.freq = freq
+        if logfreq is None:
+            logfreq = array('d', [log(f or 1) for f in freq])
+        self.logfreq = logfreq
+        if tag is None:
+            tag = array('H', [0]) * len(freq)
+        self.tag = tag
+        # tag_names[i - 1] is the tag with index i
+        self.tag_names = tuple(tag_names)
+        # chars[c - 1] is the character with code c
+        self.chars = chars
+        self.code_map = dict((ch, c) for c, ch in enumerate(chars, 1))
+        self.n_nodes = n_nodes
+        # sum of the word frequencies
+        self.total = total
+        # every walk starts at the root, so its transitions are tabulated:
+        # root_freq[c] is the frequency of the single character word with
+        # code c, root_next[c] its slot if the walk can go on, else 0
+        b = base[0]
+        self.root_freq = [0] * (len(chars) + 1)
+        self.root_logfreq = [0.0] * (len(chars) + 1)
+        self.root_next = [0] * (len(chars) + 1)
+        for c in xrange(1, len(chars) + 1):
+            if check[b + c] == 0:
+                self.root_freq[c] = freq[b + c]
+                self.root_logfreq[c] = logfreq[b + c]
+                if base[b + c]:
+                    self.root_next[c] = b + c
+
+    def __repr__(self):
+        return '<DoubleArrayTrie nodes=%d size=%d>' % (
+            self.n_nodes, len(self.base))
+
+    def __len__(self):
+        return self.n_nodes
+
+    def __contains__(self, word):
+        return self.lookup(word) > 0
+
+    @classmethod
+    def build(cls, word_freq, word_tag=None):
+        """
+        Build a trie from an iterable of (word, freq) pairs, and the POS
+        tags of the words in the dict `word_tag`, if given.
+        """
+        # every prefix of every word is a node, pure prefixes have freq 0
+        pfdict = {}
+        total = 0
+        for word, f in word_freq:
+            total += f
+            for ch in xrange(1, len(word)):
+                wfrag = word[:ch]
+                if wfrag not in pfdict:
+                    pfdict[wfrag] = 0
+            if word:
+                pfdict[word] = f
+        if not pfdict:
+            return cls(array('i', [0]), array('i', [EMPTY]), array('i', [0]),
+                       '', 0, total)
+        word_tag = word_tag or {}
+        tag_names = sorted(set(itervalues(word_tag)))
+        tag_id = dict((t, i) for i, t in enumerate(tag_names, 1))
+        # frequent characters get small codes to keep the arrays dense
+        char_count = {}
+        for key in pfdict:
+            ch = key[-1]
+            char_count[ch] = char_count.get(ch, 0) + 1
+        chars = sorted(char_count, key=lambda ch: (-char_count[ch], ch))
+        code_map = dict((ch, c) for c, ch in enumerate(chars, 1))
+
+        # node 0 is the root, children[n] holds the (code, child) pairs of
+        # node n and value[n] its frequency
+        keys = sorted(pfdict)
+        node_id = dict((key, n) for n, key in enumerate(keys, 1))
+        node_id[''] = 0
+        children = [[] for _ in xrange(len(keys) + 1)]
+        value = [0]
+        tags = [0]
+        for n, key in enumerate(keys, 1):
+            children[node_id[key[:-1]]].append((code_map[key[-1]], n))
+            value.append(pfdict[key])
+            tags.append(tag_id.get(word_tag.get(key), 0))
+        del pfdict, keys, node_id
+        n_nodes = len(value) - 1
+
+        # place the nodes with most children first, while the array is
+        # still sparse; bases do not depend on the slot of the node itself
+        size = max(len(value) * 2, 1024) + len(chars) + 1
+        used = bytearray(size)
+        used[0] = 1
+        node_base = [0] * len(value)
+        # first slot after the last used one
+        frontier = 1
+        # nodes with the same number of children tend to fail at the same
+        # places, so each group resumes scanning where the previous one
+        # succeeded
+        resume = {}
+        order = sorted((n for n in xrange(len(value)) if children[n]),
+                       key=lambda n: -len(children[n]))
+        for node in order:
+            codes = sorted(c for c, _ in children[node])
+            first = codes[0]
+            rest = codes[1:]
+            group = min(len(codes), MAX_GROUP)
+            # base 0 marks the nodes without children (see root_next), so
+            # the bases of the others start at 1
+            pos = max(first + 1, resume.get(group, 0)) - 1
+            while True:
+                pos = used.find(b'\x00', pos + 1)
+                if pos == -1:
+                    pos = len(used)
+                b = pos - first
+                if b + first >= frontier:
+                    break
+                for c in rest:
+                    if used[b + c]:
+                        break
+                else:
+                    break
+            resume[group] = pos
+            frontier = max(frontier, b + codes[-1] + 1)
+            if frontier + len(chars) >= size:
+                # keep every b + code below the frontier in range
+                grow = max(size, frontier + len(chars) + 1 - size)
+                used.extend(bytearray(grow))
+                size += grow
+            node_base[node] = b
+            for c in codes:
+                used[b + c] = 1
+        del used, order
+
+        # trim, keeping room for base + largest code so that no transition
+        # needs a bounds check; code 0 (unknown character) never matches
+        end = max(node_base) + len(chars) + 1
+        base = array('i', [0]) * end
+        check = array('i', [EMPTY]) * end
+        freq = array('i', [0]) * end
+        tag = array('H', [0]) * end
+        stack = [(0, 0)]
+        while stack:
+            node, slot = stack.pop()
+            b = base[slot] = node_base[node]
+            freq[slot] = value[node]
+            tag[slot] = tags[node]
+            for c, child in children[node]:
+                check[b + c] = slot
+                stack.append((child, b + c))
+        return cls(base, check, freq, ''.join(chars), n_nodes, total,
+                   tag=tag, tag_names=tag_names)
+
+    def dump(self, f):
+        """
+        Write the trie to the binary file object `f`.
+        """
+        tag_names = '\n'.join(self.tag_names).encode('utf-8')
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER_MARK,
+                             self.n_nodes, len(self.base), len(self.chars),
+                             self.total, len(tag_names)))
+        for arr in (self.logfreq, self.base, self.check, self.freq, self.tag):
+            f.write(_tobytes(arr))
+        f.write(self.chars.encode('utf-32-le'))
+        f.write(tag_names)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Open a trie written by `dump`.
+
+        The file is memory-mapped and the arrays are used in place, so
+        processes loading the same file share its pages. Raises ValueError
+        if the file is not in the current format.
+        """
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise ValueError('truncated trie file: %s' % path)
+            (magic, version, bom, n_nodes, size, n_chars, total,
+             n_tag_bytes) = _HEADER.unpack(header)
+            if (magic, version, bom) != (MAGIC, FORMAT_VERSION, BYTE_ORDER_MARK):
+                raise ValueError('incompatible trie file: %s' % path)
+            nbytes = 4 * size
+            if os.fstat(f.fileno()).st_size != (_HEADER.size + 5 * nbytes + 2 * size +
+                                                4 * n_chars + n_tag_bytes):
+                raise ValueError('truncated trie file: %s' % path)
+            if _CAN_MMAP:
+                buf = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                pos = _HEADER.size
+                arrays = [buf[pos:pos + 2 * nbytes].cast('d')]
+                pos += 2 * nbytes
+                for _ in xrange(3):
+                    arrays.append(buf[pos:pos + nbytes].cast('i'))
+                    pos += nbytes
+                arrays.append(buf[pos:pos + 2 * size].cast('H'))
+                pos += 2 * size
+                chars = buf[pos:pos + 4 * n_chars].tobytes()
+                tag_names = buf[pos + 4 * n_chars:].tobytes()
+            else:
+                arrays = [_frombytes(f.read(2 * nbytes), 'd')]
+                arrays.extend(_frombytes(f.read(nbytes)) for _ in xrange(3))
+                arrays.append(_frombytes(f.read(2 * size), 'H'))
+                chars = f.read(4 * n_chars)
+                tag_names = f.read()
+        logfreq, base, check, freq, tag = arrays
+        tag_names = tag_names.decode('utf-8').split('\n') if tag_names else ()
+        return cls(base, check, freq, chars.decode('utf-32-le'), n_nodes, total,
+                   logfreq, tag, tag_names)
+
+    def lookup(self, word):
+        """
+        Return the slot of `word`, or 0 if it is not a prefix of any word.
+        """
+        base = self.base
+        check = self.check
+        code_map = self.code_map
+        s = 0
+        for ch in word:
+            t = base[s] + code_map.get(ch, 0)
+            if check[t] != s:
+                return 0
+            s = t
+        return s
+
+    def get(self, word, default=None):
+        """
+        Return the frequency of `word`, 0 for prefixes, `default` otherwise.
+        """
+        s = self.lookup(word)
+        if s:
+            return self.freq[s]
+        return default
+
+    def walk(self, sentence, k, N=None, logs=False):
+        """
+        Find every word in `sentence` starting at position `k`.
+
+        Returns a list of (end, freq) where `sentence[k:end + 1]` is a word
+        of positive frequency, or (end, log(freq)) if `logs` is true. No
+        slices are allocated.
+        """
+        base = self.base
+        check = self.check
+        freq = self.freq
+        value = self.logfreq if logs else freq
+        code_map = self.code_map
+        if N is None:
+            N = len(sentence)
+        result = []
+        s = 0
+        i = k
+        while i < N:
+            t = base[s] + code_map.get(sentence[i], 0)
+            if check[t] != s:
+                break
+            s = t
+            if freq[s]:
+                result.append((i, value[s]))
+            i += 1
+        return result
+
+    def encode(self, sentence):
+        """
+        Map `sentence` to character codes, with a trailing 0 as sentinel.
+        """
+        get_code = self.code_map.get
+        codes = [get_code(ch, 0) for ch in sentence]
+        codes.append(0)
+        return codes
+
+    def get_DAG(self, sentence):
+        """
+        Return {k: [end, ...]} for every position of `sentence`, falling
+        back to [k] where no word starts.
+        """
+        base = self.base
+        check = self.check
+        freq = self.freq
+        root_freq = self.root_freq
+        root_next = self.root_next
+        codes = self.encode(sentence)
+        DAG = {}
+        for k in xrange(len(sentence)):
+            c = codes[k]
+            s = root_next[c]
+            if not s:
+                DAG[k] = [k]
+                continue
+            tmplist = [k] if root_freq[c] else []
+            i = k + 1
+            while True:
+                t = base[s] + codes[i]
+                if check[t] != s:
+                    break
+                if freq[t]:
+                    tmplist.append(i)
+                s = t
+                i += 1
+            DAG[k] = tmplist or [k]
+        return DAG
+
+    def calc(self, sentence, DAG, route, logtotal, heads=(), slow_walk=None):
+        """
+        Fill `route` with the best path over `DAG`, as Tokenizer.calc.
+
+        The log frequencies are precomputed and read along one walk per
+        position; positions whose character is in `heads` use
+        `slow_walk(sentence, k, N, logs=True)` instead. Ties go to the
+        longest word, as with max() over (prob, end) tuples.
+        """
+        base = self.base
+        check = self.check
+        freq = self.freq
+        logfreq = self.logfreq
+        root_freq = self.root_freq
+        root_logfreq = self.root_logfreq
+        root_next = self.root_next
+        codes = self.encode(sentence)
+        N = len(sentence)
+        route[N] = (0, 0)
+        for idx in xrange(N - 1, -1, -1):
+            if heads and sentence[idx] in heads:
+                lf = dict(slow_walk(sentence, idx, N, True))
+            else:
+                lf = {}
+                c = codes[idx]
+                if root_freq[c]:
+                    lf[idx] = root_logfreq[c]
+                s = root_next[c]
+                if s:
+                    i = idx + 1
+                    while True:
+                        t = base[s] + codes[i]
+                        if check[t] != s:
+                            break
+                        if freq[t]:
+                            lf[i] = logfreq[t]
+                        s = t
+                        i += 1
+            best = None
+            # DAG lists are in increasing order
+            for x in DAG[idx]:
+                p = lf.get(x, 0.0) - logtotal + route[x + 1][0]
+                if best is None or p >= best:
+                    best = p
+                    end = x
+            route[idx] = (best, end)
+
+    def cut_all(self, sentence, heads=(), slow_walk=None):
+        """
+        Return the words of the full mode cut of `sentence`, as emitted
+        from get_DAG by Tokenizer.__cut_all, found in the same walk that
+        builds each DAG list; positions whose character is in `heads` use
+        `slow_walk(sentence, k, N)` instead.
+        """
+        base = self.base
+        check = self.check
+        freq = self.freq
+        root_freq = self.root_freq
+        root_next = self.root_next
+        codes = self.encode(sentence)
+        N = len(sentence)
+        words = []
+        old_j = -1
+        for k in xrange(N):
+            if heads and sentence[k] in heads:
+                L = [i for i, _ in slow_walk(sentence, k, N)] or [k]
+            else:
+                c = codes[k]
+                s = root_next[c]
+                if not s:
+                    # DAG[k] == [k]
+                    if k > old_j:
+                        words.append(sentence[k])
+                        old_j = k
+                    continue
+                L = [k] if root_freq[c] else []
+                i = k + 1
+                while True:
+                    t = base[s] + codes[i]
+                    if check[t] != s:
+                        break
+                    if freq[t]:
+                        L.append(i)
+                    s = t
+                    i += 1
+                if not L:
+                    L = [k]
+            if len(L) == 1 and k > old_j:
+                words.append(sentence[k:L[0] + 1])
+                old_j = L[0]
+            else:
+                for j in L:
+                    if j > k:
+                        words.append(sentence[k:j + 1])
+                        old_j = j
+        return words
+
+    def best_path(self, sentence, logtotal, heads=(), slow_walk=None, paths=None):
+        """
+        Find the most probable segmentation of `sentence`.
+
+        Candidate words and the dynamic programming are done in one
+        right-to-left pass; the result is the `ends` array of `paths`
+        (a PathBuffer, allocated if not given): the word starting at x on
+        the best path is `sentence[x:ends[x]]`. Gives the same path as
+        get_DAG + calc.
+        """
+        base = self.base
+        check = self.check
+        freq = self.freq
+        logfreq = self.logfreq
+        root_freq = self.root_freq
+        root_logfreq = self.root_logfreq
+        root_next = self.root_next
+        codes = self.encode(sentence)
+        N = len(sentence)
+        if paths is None:
+            paths = PathBuffer()
+        paths.reserve(N + 1)
+        prob = paths.prob
+        ends = paths.ends
+        prob[N] = 0.0
+        for idx in xrange(N - 1, -1, -1):
+            best = MIN_INF
+            end = -1
+            if heads and sentence[idx] in heads:
+                for i, lf in slow_walk(sentence, idx, N, True):
+                    p = lf - logtotal + prob[i + 1]
+                    if p >= best:
+                        best = p
+                        end = i
+            else:
+                c = codes[idx]
+                if root_freq[c]:
+                    best = root_logfreq[c] - logtotal + prob[idx + 1]
+                    end = idx
+                s = root_next[c]
+                if s:
+                    i = idx + 1
+                    while True:
+                        t = base[s] + codes[i]
+                        if check[t] != s:
+                            break
+                        if freq[t]:
+                            p = logfreq[t] - logtotal + prob[i + 1]
+                            # ties go to the longest word
+                            if p >= best:
+                                best = p
+                                end = i
+                        s = t
+                        i += 1
+            if end < 0:
+                # no word starts here, take the single character
+                best = 0.0 - logtotal + prob[idx + 1]
+                end = idx
+            prob[idx] = best
+            ends[idx] = end + 1
+        return ends
+
+    def get_tag(self, word, default=None):
+        """
+        Return the POS tag of `word`, `default` if it has none.
+        """
+        t = self.tag[self.lookup(word)]
+        return self.tag_names[t - 1] if t else default
+
+    def tag_items(self):
+        """
+        Yield (word, tag) for every word with a tag.
+        """
+        tag = self.tag
+        tag_names = self.tag_names
+        for key, t in self.nodes():
+            if tag[t]:
+                yield key, tag_names[tag[t] - 1]
+
+    def items(self):
+        """
+        Yield (key, freq) for every node, in breadth-first order.
+        """
+        freq = self.freq
+        for key, t in self.nodes():
+            yield key, freq[t]
+
+    def nodes(self):
+        """
+        Yield (key, slot) for every node, in breadth-first order.
+        """
+        check = self.check
+        base = self.base
+        chars = self.chars
+        children = {}
+        for t in xrange(1, len(check)):
+            p = check[t]
+            if p != EMPTY:
+                children.setdefault(p, []).append(t)
+        queue = [(0, '')]
+        for s, prefix in queue:
+            for t in children.get(s, ()):
+                key = prefix + chars[t - base[s] - 1]
+                yield key, t
+                queue.append((t, key))
+
+
+class PathBuffer(object):
+    """
+    Arrays reused by successive best_path calls: prob[x] is the log
+    probability of the best segmentation of sentence[x:] and ends[x] the
+    end of its first word.
+    """
+
+    __slots__ = ('prob', 'ends')
+
+    def __init__(self):
+        self.prob = array('d')
+        self.ends = array('i')
+
+    def reserve(self, n):
+        grow = n - len(self.ends)
+        if grow > 0:
+            self.prob.extend(array('d', [0.0]) * grow)
+            self.ends.extend(array('i', [0]) * grow)
+
+
+class PrefixDict(object):
+    """
+    The FREQ mapping of a Tokenizer.
+
+    Lookups go to a shared `DoubleArrayTrie`; words added at runtime are
+    kept in a small per-instance overlay with the same semantics as the
+    old prefix dict: every prefix is a key, pure prefixes map to 0.
+    """
+
+    def __init__(self, trie):
+        self.trie = trie
+        self.overlay = {}
+        # log(freq or 1) of the overlay keys, kept in step with overlay
+        self.overlay_log = {}
+        # first characters of overlay keys, to skip the slow path quickly
+        self.overlay_heads = set()
+
+    def __repr__(self):
+        return '<PrefixDict trie=%r overlay=%d>' % (self.trie, len(self.overlay))
+
+    def __contains__(self, word):
+        return word in self.overlay or self.trie.lookup(word) > 0
+
+    def __getitem__(self, word):
+        freq = self.get(word)
+        if freq is None:
+            raise KeyError(word)
+        return freq
+
+    def __setitem__(self, word, freq):
+        self.overlay[word] = freq
+        self.overlay_log[word] = log(freq or 1)
+        self.overlay_heads.add(word[:1])
+
+    def __len__(self):
+        return len(self.trie) + sum(
+            1 for k in self.overlay if not self.trie.lookup(k))
+
+    def __iter__(self):
+        for k, _ in self.items():
+            yield k
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        overlay = self.overlay
+        for k, v in self.trie.items():
+            yield k, overlay.get(k, v)
+        for k, v in iteritems(overlay):
+            if not self.trie.lookup(k):
+                yield k, v
+
+    def get(self, word, default=None):
+        if word in self.overlay:
+            return self.overlay[word]
+        return self.trie.get(word, default)
+
+    def walk(self, sentence, k, N=None, logs=False):
+        """
+        Find every word starting at `sentence[k]`, overlay included.
+
+        Returns a list of (end, freq) with positive freq, ordered by end,
+        or (end, log(freq)) if `logs` is true.
+        """
+        if N is None:
+            N = len(sentence)
+        if sentence[k] not in self.overlay_heads:
+            return self.trie.walk(sentence, k, N, logs)
+        # slow path: a runtime-added key may start here
+        trie = self.trie
+        base = trie.base
+        check = trie.check
+        tfreq = trie.freq
+        tvalue = trie.logfreq if logs else tfreq
+        code_map = trie.code_map
+        overlay = self.overlay
+        ovalue = self.overlay_log if logs else overlay
+        result = []
+        s = 0
+        i = k
+        while i < N:
+            if s >= 0:
+                t = base[s] + code_map.get(sentence[i], 0)
+                s = t if check[t] == s else -1
+            frag = sentence[k:i + 1]
+            if frag in overlay:
+                if overlay[frag]:
+                    result.append((i, ovalue[frag]))
+            elif s >= 0:
+                if tfreq[s]:
+                    result.append((i, tvalue[s]))
+            else:
+                break
+            i += 1
+        return result
+
+    def get_DAG(self, sentence):
+        DAG = self.trie.get_DAG(sentence)
+        heads = self.overlay_heads
+        if heads:
+            N = len(sentence)
+            for k, ch in enumerate(sentence):
+                if ch in heads:
+                    DAG[k] = [i for i, _ in self.walk(sentence, k, N)] or [k]
+        return DAG
+
+    def calc(self, sentence, DAG, route, logtotal):
+        self.trie.calc(sentence, DAG, route, logtotal,
+                       self.overlay_heads, self.walk)
+
+    def best_path(self, sentence, logtotal, paths=None):
+        return self.trie.best_path(sentence, logtotal, self.overlay_heads,
+                                   self.walk, paths)
+
+    def cut_all(self, sentence):
+        return self.trie.cut_all(sentence, self.overlay_heads, self.walk)
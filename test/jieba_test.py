@@ -1,5 +1,6 @@
 #-*-coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
+import os
 import sys
 sys.path.append("../")
 import unittest
@@ -201,5 +202,509 @@ class JiebaTestCase(unittest.TestCase):
             print(" , ".join(result), file=sys.stderr)
         print("testCutForSearch_NOHMM", file=sys.stderr)
 
+    def testDoubleArrayTrie(self):
+        pfdict, total = jieba.dt.gen_pfdict(jieba.dt.get_dict_file())
+        trie, trie_total = jieba.dt.gen_trie(jieba.dt.get_dict_file())
+        assert trie_total == total, "Test DoubleArrayTrie total error"
+        assert dict(trie.items()) == pfdict, "Test DoubleArrayTrie items error"
+        for content in test_contents:
+            for k in range(len(content)):
+                expected = [(i, pfdict[content[k:i + 1]]) for i in range(k, len(content))
+                            if pfdict.get(content[k:i + 1])]
+                assert trie.walk(content, k) == expected, \
+                    "Test DoubleArrayTrie walk error on content: %s" % content
+        print("testDoubleArrayTrie", file=sys.stderr)
+
+    def testDoubleArrayTrieRandom(self):
+        import random
+        from jieba.trie import DoubleArrayTrie
+        rnd = random.Random(1)
+        alphabet = "一丂七丄丅丆万丈三上下"
+        for _ in range(300):
+            word_freq = [("".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 4))),
+                          rnd.randint(0, 3)) for _ in range(rnd.randint(1, 12))]
+            pfdict = {}
+            for word, freq in word_freq:
+                for i in range(1, len(word)):
+                    pfdict.setdefault(word[:i], 0)
+                pfdict[word] = freq
+            trie = DoubleArrayTrie.build(word_freq)
+            for _ in range(5):
+                sentence = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 10)))
+                expected = {}
+                for k in range(len(sentence)):
+                    ends = [i for i in range(k, len(sentence))
+                            if pfdict.get(sentence[k:i + 1])]
+                    i = k
+                    while i < len(sentence) and sentence[k:i + 1] in pfdict:
+                        i += 1
+                    expected[k] = [e for e in ends if e < i] or [k]
+                assert trie.get_DAG(sentence) == expected, \
+                    "Test DoubleArrayTrieRandom error on %r with %r" % (sentence, word_freq)
+        print("testDoubleArrayTrieRandom", file=sys.stderr)
+
+    def testTrieCacheFile(self):
+        import tempfile
+        from jieba.trie import DoubleArrayTrie
+        trie, total = jieba.dt.gen_trie(jieba.dt.get_dict_file())
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            trie.dump(f)
+        loaded = DoubleArrayTrie.load(path)
+        assert loaded.total == total, "Test TrieCacheFile total error"
+        for content in test_contents:
+            assert loaded.get_DAG(content) == trie.get_DAG(content), \
+                "Test TrieCacheFile error on content: %s" % content
+        tags = dict(trie.tag_items())
+        assert tags["北京"] == "ns" and dict(loaded.tag_items()) == tags, \
+            "Test TrieCacheFile tags error"
+        assert loaded.get_tag("北京天") is None and loaded.get_tag("foo", "x") == "x", \
+            "Test TrieCacheFile get_tag error"
+        with open(path, 'r+b') as f:
+            f.write(b'JIEBAXXX')
+        self.assertRaises(ValueError, DoubleArrayTrie.load, path)
+        del loaded
+        os.remove(path)
+        print("testTrieCacheFile", file=sys.stderr)
+
+    def testSharedModel(self):
+        import jieba.posseg as pseg
+        tk1 = jieba.Tokenizer()
+        tk2 = jieba.Tokenizer()
+        tk1.initialize()
+        tk2.initialize()
+        assert tk1.FREQ.trie is tk2.FREQ.trie, "Test SharedModel sharing error"
+        tk1.add_word("石墨烯", 2000, "n")
+        assert tk1.FREQ.get("石墨烯") == 2000, "Test SharedModel add_word error"
+        assert tk2.FREQ.get("石墨烯") is None, "Test SharedModel overlay error"
+        assert tk1.total != tk2.total, "Test SharedModel total error"
+        ptk1 = pseg.POSTokenizer(tk1)
+        ptk2 = pseg.POSTokenizer(tk2)
+        assert ptk1.word_tag_tab.base is ptk2.word_tag_tab.base, \
+            "Test SharedModel word tag sharing error"
+        assert ("石墨烯", "n") in [tuple(p) for p in ptk1.cut("石墨烯")]
+        assert "石墨烯" not in ptk2.word_tag_tab
+        print("testSharedModel", file=sys.stderr)
+
+    def testCalcLogFreq(self):
+        from math import log
+        tk = jieba.Tokenizer()
+        tk.add_word("石墨烯", 2000)
+        tk.add_word("孙悟空是", 5)
+        tk.del_word("北京")
+        logtotal = log(tk.total)
+        for content in test_contents:
+            DAG = tk.get_DAG(content)
+            route = {}
+            tk.calc(content, DAG, route)
+            expected = {len(content): (0, 0)}
+            for idx in range(len(content) - 1, -1, -1):
+                expected[idx] = max((log(tk.FREQ.get(content[idx:x + 1]) or 1) - logtotal +
+                                     expected[x + 1][0], x) for x in DAG[idx])
+            assert route == expected, "Test CalcLogFreq error on content: %s" % content
+        print("testCalcLogFreq", file=sys.stderr)
+
+    def testBestPath(self):
+        tk = jieba.Tokenizer()
+        tk.add_word("石墨烯", 2000)
+        tk.add_word("孙悟空是", 5)
+        tk.del_word("北京")
+        paths = jieba.PathBuffer()
+        for content in test_contents:
+            route = {}
+            tk.calc(content, tk.get_DAG(content), route)
+            ends = tk.best_path(content, paths)
+            assert [ends[x] for x in range(len(content))] == \
+                [route[x][1] + 1 for x in range(len(content))], \
+                "Test BestPath error on content: %s" % content
+        print("testBestPath", file=sys.stderr)
+
+    def testCutAllWalk(self):
+        tk = jieba.Tokenizer()
+        tk.add_word("石墨烯", 2000)
+        tk.del_word("北京")
+        for content in test_contents:
+            for blk in jieba.re_han_cut_all.findall(content):
+                # the words of full mode as emitted from get_DAG
+                expected = []
+                old_j = -1
+                for k, L in sorted(tk.get_DAG(blk).items()):
+                    if len(L) == 1 and k > old_j:
+                        expected.append(blk[k:L[0] + 1])
+                        old_j = L[0]
+                    else:
+                        for j in L:
+                            if j > k:
+                                expected.append(blk[k:j + 1])
+                                old_j = j
+                assert tk.FREQ.cut_all(blk) == expected, \
+                    "Test CutAllWalk error on content: %s" % content
+        print("testCutAllWalk", file=sys.stderr)
+
+    def testCutBatch(self):
+        import jieba.posseg as pseg
+        texts = test_contents + test_contents[:10]
+        assert jieba.cut_batch(texts) == [jieba.lcut(t) for t in texts], "Test CutBatch error"
+        assert jieba.cut_batch(texts, cut_all=True, HMM=False) == \
+            [jieba.lcut(t, cut_all=True, HMM=False) for t in texts], "Test CutBatch cut_all error"
+        assert jieba.cut_for_search_batch(texts) == \
+            [jieba.lcut_for_search(t) for t in texts], "Test CutBatch search error"
+        assert pseg.cut_batch(texts) == [pseg.lcut(t) for t in texts], "Test CutBatch posseg error"
+        words, offsets = jieba.cut_batch(texts, flat=True)
+        assert [words[offsets[i]:offsets[i + 1]] for i in range(len(texts))] == \
+            jieba.cut_batch(texts), "Test CutBatch flat error"
+        assert (jieba.cut_batch(iter(texts)), jieba.cut_for_search_batch(t for t in texts),
+                pseg.cut_batch(iter(texts))) == \
+            (jieba.cut_batch(texts), jieba.cut_for_search_batch(texts), pseg.cut_batch(texts)), \
+            "Test CutBatch iterator error"
+        # unknown words of all the texts go through the batch decoders
+        import random
+        rnd = random.Random(8)
+        rare = "".join("%c" % rnd.randint(0x4e00, 0x4e00 + 3000) for _ in range(600))
+        texts = ["%s，%s。%s" % (rare[i:i + 3], t, rare[i + 3:i + 7]) for i, t in
+                 zip(range(0, len(rare), 7), test_contents * 3)] + test_contents[:5] * 2
+        tk = jieba.Tokenizer()
+        tk.enable_block_cache(100)
+        batches = []
+        decode_batch = tk.segmenter.decode_batch
+        tk.segmenter.decode_batch = lambda seqs: batches.append(len(seqs)) or decode_batch(seqs)
+        assert tk.cut_batch(texts) == [tk.lcut(t) for t in texts], "Test CutBatch HMM error"
+        assert len(batches) == 1 and batches[0] > 50, "Test CutBatch decode_batch error"
+        tk.segmenter.memo.clear()
+        assert tk.cut_for_search_batch(texts) == [tk.lcut_for_search(t) for t in texts], \
+            "Test CutBatch HMM search error"
+        ptk = pseg.POSTokenizer(tk)
+        assert ptk.cut_batch(texts) == [ptk.lcut(t) for t in texts], "Test CutBatch posseg HMM error"
+        print("testCutBatch", file=sys.stderr)
+
+    def testBlockCache(self):
+        tk = jieba.Tokenizer()
+        tk.enable_block_cache(100)
+        expected = [tk.lcut(t) for t in test_contents]
+        assert [tk.lcut(t) for t in test_contents] == expected, "Test BlockCache error"
+        info = tk.block_cache_info()
+        assert info['hits'] > 0 and info['size'] <= 100, "Test BlockCache info error"
+        assert "石墨烯" not in tk.lcut("石墨烯")
+        tk.add_word("石墨烯")
+        assert "石墨烯" in tk.lcut("石墨烯"), "Test BlockCache invalidation error"
+        tk.disable_block_cache()
+        assert tk.block_cache_info() is None
+        print("testBlockCache", file=sys.stderr)
+
+    def testFinalsegMemo(self):
+        from jieba import finalseg
+        word = "孙君意"
+        first = list(finalseg.cut(word))
+        hits = finalseg.memo.hits
+        assert list(finalseg.cut(word)) == first, "Test FinalsegMemo error"
+        assert finalseg.memo.hits == hits + 1, "Test FinalsegMemo hit error"
+        assert first == [word]
+        finalseg.add_force_split(word)
+        assert list(finalseg.cut(word)) == list(word), "Test FinalsegMemo force split error"
+        finalseg.Force_Split_Words.discard(word)
+        print("testFinalsegMemo", file=sys.stderr)
+
+    def testSegmenter(self):
+        import os
+        from jieba import finalseg
+        from jieba.posseg import POSTokenizer, HMM_MODEL
+        word = "孙君意"
+        tk1, tk2 = jieba.Tokenizer(), jieba.Tokenizer()
+        tk1.del_word(word)
+        assert list(tk1.segmenter.cut(word)) == list(word), "Test Segmenter force split error"
+        assert list(tk2.segmenter.cut(word)) == [word], "Test Segmenter isolation error"
+        assert word not in finalseg.Force_Split_Words, "Test Segmenter global error"
+        path = os.path.join(os.path.dirname(finalseg.__file__), finalseg.HMM_MODEL)
+        seg1, seg2 = finalseg.Segmenter(path), finalseg.Segmenter(path)
+        assert seg1.model is seg2.model, "Test Segmenter shared model error"
+        assert seg1.cut_batch(test_contents) == finalseg.cut_batch(test_contents), \
+            "Test Segmenter model file error"
+        path = os.path.join(os.path.dirname(finalseg.__file__), "..", "posseg", HMM_MODEL)
+        ptk = POSTokenizer(jieba.dt, hmm_model=path)
+        assert ptk.hmm_model is POSTokenizer(jieba.dt, hmm_model=path).hmm_model
+        assert ptk.lcut(test_contents[0]) == jieba.posseg.lcut(test_contents[0]), \
+            "Test Segmenter posseg model error"
+        print("testSegmenter", file=sys.stderr)
+
+    def testTrainHMM(self):
+        import os
+        import shutil
+        import tempfile
+        from jieba import finalseg, train
+        from jieba.posseg import POSTokenizer, compact_viterbi
+        segmented = ["我 来到 北京 清华大学", "他 来到 了 网易 杭研 大厦"] * 3
+        tagged = ["我/r 来到/v 北京/ns 清华大学/nt", "他/r 来到/v 了/ul 网易/nz 大厦/n"] * 3
+        tmp = tempfile.mkdtemp()
+        try:
+            corpus = os.path.join(tmp, "corpus.txt")
+            with open(corpus, "wb") as f:
+                f.write("\n".join(segmented).encode("utf-8"))
+            serial = train.count_corpus(segmented, processes=1, chunk_lines=4)
+            pooled = train.count_corpus(segmented, processes=2, chunk_lines=1)
+            assert (serial.start, serial.trans, serial.emit, serial.lines) == \
+                (pooled.start, pooled.trans, pooled.emit, pooled.lines), "Test TrainHMM parallel counts error"
+            output = os.path.join(tmp, "bmes.bin")
+            train.train([corpus], output, processes=1)
+            seg = finalseg.Segmenter(output)
+            assert seg.cut_batch(["清华大学", "网易杭研"]) == [["清华大学"], ["网易", "杭研"]], \
+                "Test TrainHMM finalseg error"
+            bmes = output
+            output = os.path.join(tmp, "pos.bin")
+            with open(output, "wb") as f:
+                train.count_corpus(tagged, tagged=True, processes=1).to_model(tagged=True).dump(f)
+            ptk = POSTokenizer(jieba.Tokenizer(hmm_model=bmes), hmm_model=output)
+            prob, route = compact_viterbi("北京", ptk.hmm_model)
+            assert route == [("B", "ns"), ("E", "ns")], "Test TrainHMM posseg error"
+            # models given by path can still be snapshotted once loaded
+            expected = ptk.lcut("网易杭研")
+            state = ptk.snapshot()
+            assert (state['hmm_model'], state['tokenizer']['hmm_model']) == (output, bmes), \
+                "Test TrainHMM snapshot error"
+            assert POSTokenizer.from_snapshot(state).lcut("网易杭研") == expected, \
+                "Test TrainHMM from_snapshot error"
+        finally:
+            shutil.rmtree(tmp)
+        print("testTrainHMM", file=sys.stderr)
+
+    def testParallelTokenizer(self):
+        import itertools
+        import jieba.posseg as pseg
+        text = "\n".join(test_contents[:20])
+        tk = jieba.Tokenizer()
+        tk.add_word("石墨烯", tag="nz")
+        tk.del_word("清华大学")
+        with jieba.ParallelTokenizer(tk, 2) as ptk:
+            assert ptk.lcut(text) == tk.lcut(text), "Test ParallelTokenizer cut error"
+            assert ptk.lcut(text, True) == tk.lcut(text, True), "Test ParallelTokenizer cut_all error"
+            assert ptk.lcut(text, HMM=False) == tk.lcut(text, HMM=False), "Test ParallelTokenizer no HMM error"
+            assert ptk.lcut_for_search(text) == tk.lcut_for_search(text), \
+                "Test ParallelTokenizer cut_for_search error"
+            for mode in ("default", "search"):
+                assert list(ptk.tokenize(text, mode)) == list(tk.tokenize(text, mode)), \
+                    "Test ParallelTokenizer tokenize error"
+            tk.add_word("杭研")
+            assert ptk.lcut(text) == tk.lcut(text), "Test ParallelTokenizer update error"
+            lines = text.splitlines(True)
+            assert list(ptk.cut_lines(iter(lines))) == tk.lcut(text), "Test ParallelTokenizer cut_lines error"
+            assert list(ptk.cut_lines(lines, True)) == tk.lcut(text, True), \
+                "Test ParallelTokenizer cut_lines cut_all error"
+            assert list(ptk.cut_for_search_lines(lines, False)) == tk.lcut_for_search(text, False), \
+                "Test ParallelTokenizer cut_for_search_lines error"
+            consumed = []
+
+            def endless():
+                while True:
+                    consumed.append(1)
+                    yield text
+
+            words = list(itertools.islice(ptk.cut_lines(endless()), 10))
+            assert words == tk.lcut(text)[:10], "Test ParallelTokenizer stream error"
+            assert len(consumed) * len(text) < 10 * jieba.parallel.CHUNK_SIZE, \
+                "Test ParallelTokenizer stream read ahead error"
+        postk = pseg.POSTokenizer(tk)
+        with jieba.ParallelTokenizer(postk, 2) as ptk:
+            assert ptk.lcut(text) == postk.lcut(text), "Test ParallelTokenizer posseg error"
+            assert ptk.lcut(text, False) == postk.lcut(text, False), "Test ParallelTokenizer posseg no HMM error"
+        print("testParallelTokenizer", file=sys.stderr)
+
+    def testParallelChunks(self):
+        import random
+        import jieba.posseg as pseg
+        from jieba.parallel import split_text
+        text = "\n".join(test_contents) * 3
+        rnd = random.Random(22)
+        cuts = sorted(rnd.sample(range(len(text)), 50))
+        pieces = [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+        for pattern, lcut in ((jieba.re_han_default, jieba.lcut),
+                              (jieba.re_han_cut_all, lambda t: jieba.lcut(t, True)),
+                              (jieba.re_han_default, jieba.lcut_for_search),
+                              (pseg.re_han_internal, pseg.dt.lcut)):
+            chunks = list(split_text(pieces, pattern, 100))
+            assert "".join(chunks) == text, "Test ParallelChunks join error"
+            assert len(chunks) > 10, "Test ParallelChunks size error"
+            assert [w for chunk in chunks for w in lcut(chunk)] == lcut(text), \
+                "Test ParallelChunks words error"
+        # a long block read in pieces ends a single chunk
+        run = "中" * 20000 + "，" + "中" * 50
+        assert list(split_text((run[i:i + 7] for i in range(0, len(run), 7)),
+                               jieba.re_han_default, 100)) == [run[:20001], run[20001:]], \
+            "Test ParallelChunks long block error"
+        # a single line still makes several tasks
+        line = text.replace("\n", " ")
+        expected = jieba.lcut(line), jieba.lcut(line, True), jieba.lcut_for_search(line), pseg.lcut(line)
+        jieba.enable_parallel(2)
+        try:
+            assert (list(jieba.cut(line)), list(jieba.cut(line, True)), list(jieba.cut_for_search(line)),
+                    pseg.lcut(line)) == expected, "Test ParallelChunks enable_parallel error"
+        finally:
+            jieba.disable_parallel()
+        print("testParallelChunks", file=sys.stderr)
+
+    def testParallelTransport(self):
+        import jieba.posseg as pseg
+        from jieba.parallel import TRANSPORTS, packed
+        tk = jieba.dt
+        for text in test_contents:
+            for name, lcut, tokenizer in (('cut', jieba.lcut, tk),
+                                          ('cut_all', lambda t: jieba.lcut(t, True), tk),
+                                          ('search', jieba.lcut_for_search, tk),
+                                          ('pos', pseg.lcut, pseg.dt)):
+                encode, decode = TRANSPORTS[name]
+                result = encode(tokenizer, text)
+                assert decode(text, result) == lcut(text), \
+                    "Test ParallelTransport %s error on content: %s" % (name, text)
+        lengths, ids, tags = TRANSPORTS['pos'][0](pseg.dt, test_contents[0])
+        assert lengths.typecode == ids.typecode == 'B' and len(set(tags)) == len(tags), \
+            "Test ParallelTransport pos error"
+        assert packed([1, 300]).typecode == 'H' and packed([-1, 1], True).typecode == 'b', \
+            "Test ParallelTransport packed error"
+        import gc
+        from jieba.parallel import start_pool
+        if hasattr(gc, 'freeze'):
+            # a freeze made by the application outlives the pool
+            gc.freeze()
+            try:
+                frozen = gc.get_freeze_count()
+                pool = start_pool(1)
+                pool.close()
+                pool.join()
+                assert gc.get_freeze_count() == frozen, "Test ParallelTransport gc freeze error"
+            finally:
+                gc.unfreeze()
+        print("testParallelTransport", file=sys.stderr)
+
+    def testParallelStartMethods(self):
+        import multiprocessing
+        import jieba.posseg as pseg
+        if not hasattr(multiprocessing, 'get_context'):
+            self.skipTest("start methods need Python 3.4+")
+        text = "\n".join(test_contents)
+        tk = jieba.Tokenizer()
+        tk.add_word("石墨烯", 2000, "n")
+        tk.add_word("一了百了", 0)
+        ptk = pseg.POSTokenizer(tk)
+        with jieba.ParallelTokenizer(ptk, 2, 'spawn') as par:
+            assert par.lcut(text) == ptk.lcut(text), "Test ParallelStartMethods spawn error"
+        # spawned workers load the global tokenizers from a snapshot
+        jieba.add_word("石墨烯", 2000, "n")
+        text += "石墨烯"
+        expected = jieba.lcut(text), pseg.lcut(text)
+        jieba.enable_parallel(2, start_method='spawn')
+        try:
+            assert (list(jieba.cut(text)), pseg.lcut(text)) == expected, \
+                "Test ParallelStartMethods enable_parallel error"
+        finally:
+            jieba.disable_parallel()
+        # the application can still choose the global start method afterwards
+        import subprocess
+        script = ("import sys, multiprocessing; sys.path.insert(0, %r); import jieba\n"
+                  "jieba.enable_parallel(2); repr(jieba.ParallelTokenizer(jieba.dt, 2))\n"
+                  "list(jieba.cut('我来到北京清华大学')); jieba.disable_parallel()\n"
+                  "multiprocessing.set_start_method('spawn')\n") % os.path.abspath("..")
+        assert subprocess.call([sys.executable, "-c", script]) == 0, \
+            "Test ParallelStartMethods set_start_method error"
+        print("testParallelStartMethods", file=sys.stderr)
+
+    def testFinalsegDecoders(self):
+        from jieba import finalseg
+        for content in test_contents + ["".join(test_contents)]:
+            for blk in finalseg.re_han.findall(content):
+                assert finalseg.viterbi_backpointer(blk) == finalseg.python_viterbi(blk), \
+                    "Test FinalsegDecoders error on content: %s" % content
+        finalseg.set_decoder('python')
+        expected = [jieba.lcut(t) for t in test_contents]
+        finalseg.set_decoder('backpointer')
+        assert [jieba.lcut(t) for t in test_contents] == expected, "Test FinalsegDecoders cut error"
+        self.assertRaises(ValueError, finalseg.set_decoder, 'foo')
+        print("testFinalsegDecoders", file=sys.stderr)
+
+    def testFinalsegNumpyDecoder(self):
+        from jieba import finalseg
+        if finalseg.import_numpy() is None:
+            self.skipTest("NumPy is not installed")
+        import random
+        rnd = random.Random(14)
+        # rare characters give many ties between paths
+        rare = "".join("%c" % rnd.randint(0x4e00, 0x4e00 + 3000) for _ in range(3000))
+        for content in test_contents + [rare]:
+            for blk in finalseg.re_han.findall(content):
+                assert finalseg.viterbi_numpy(blk) == finalseg.python_viterbi(blk), \
+                    "Test FinalsegNumpyDecoder error on content: %s" % content
+        print("testFinalsegNumpyDecoder", file=sys.stderr)
+
+    def testFinalsegHMMModel(self):
+        from jieba import finalseg
+        model = finalseg.get_hmm_model()
+        source = finalseg.load_source_model()
+        assert model.to_dicts() == source.to_dicts(), "Test FinalsegHMMModel tables error"
+        assert list(model.emit_dense) == list(source.emit_dense), "Test FinalsegHMMModel emit_dense error"
+        start_p, trans_p, emit_p, _ = source.to_dicts()
+        for ch in "\u4e00\u4e2d\u6587\u00e9":
+            i = model.emit_offset(ch)
+            assert list(model.emit_dense[i:i + 4]) == [emit_p[y].get(ch, finalseg.MIN_FLOAT) for y in "BEMS"], \
+                "Test FinalsegHMMModel emission row error"
+        # models without the dense emission matrix work with every decoder
+        text = "锕镧钐铕钆是稀土元素"
+        expected = jieba.Tokenizer().lcut(text)
+        for decoder in ('backpointer', 'numpy', 'python'):
+            tk = jieba.Tokenizer(hmm_model=finalseg.HMMModel.from_dicts(*source.to_dicts()[:3]))
+            tk.segmenter.set_decoder(decoder)
+            assert tk.lcut(text) == expected, "Test FinalsegHMMModel sparse model error"
+        print("testFinalsegHMMModel", file=sys.stderr)
+
+    def testDecodeBatch(self):
+        from jieba import finalseg
+        from jieba.posseg import get_hmm_model
+        from jieba.posseg.viterbi import compact_viterbi, compact_viterbi_batch
+        import random
+        rnd = random.Random(15)
+        rare = "".join("%c" % rnd.randint(0x4e00, 0x4e00 + 3000) for _ in range(3000))
+        blocks = [blk for content in test_contents for blk in finalseg.re_han.findall(content)]
+        # enough sequences of the same length to be decoded as a group
+        blocks += [rare[i:i + 3] for i in range(0, len(rare), 3)]
+        assert finalseg.decode_batch(blocks) == [finalseg.decode(blk) for blk in blocks], \
+            "Test DecodeBatch error"
+        finalseg.memo.clear()
+        assert finalseg.cut_batch(test_contents) == [list(finalseg.cut(content)) for content in test_contents], \
+            "Test DecodeBatch cut_batch error"
+        model = get_hmm_model()
+        assert compact_viterbi_batch(blocks[:50] * 2, model) == [compact_viterbi(blk, model) for blk in blocks[:50] * 2], \
+            "Test DecodeBatch posseg error"
+        print("testDecodeBatch", file=sys.stderr)
+
+    def testPossegBeamWidth(self):
+        import jieba.posseg as pseg
+        import jieba.analyse
+        for content in test_contents:
+            exact = pseg.lcut(content)
+            assert pseg.lcut(content, beam_width=None) == exact, \
+                "Test PossegBeamWidth exact error on content: %s" % content
+            result = pseg.lcut(content, beam_width=4)
+            assert "".join(w.word for w in result) == content, \
+                "Test PossegBeamWidth error on content: %s" % content
+        ptk = pseg.POSTokenizer(jieba.dt, beam_width=4)
+        assert ptk.lcut(test_contents[0]) == pseg.lcut(test_contents[0], beam_width=4)
+        assert isinstance(jieba.analyse.textrank(test_contents[71], beam_width=4), list)
+        print("testPossegBeamWidth", file=sys.stderr)
+
+    def testPossegHMMModel(self):
+        import jieba.posseg as pseg
+        from jieba.posseg.viterbi import viterbi, compact_viterbi
+        model = pseg.get_hmm_model()
+        source = pseg.load_source_model()
+        assert model.to_dicts() == source.to_dicts(), "Test PossegHMMModel tables error"
+        for y, row in enumerate(model.prev):
+            assert list(row) == sorted((x, model.trans[x][y])
+                                       for x in range(len(model.labels))
+                                       if y in model.trans[x]), \
+                "Test PossegHMMModel reverse index error"
+        start_p, trans_p, emit_p, char_state_tab = source.to_dicts()
+        for content in test_contents:
+            for blk in pseg.re_han_detail.findall(content):
+                assert compact_viterbi(blk, model) == viterbi(
+                    blk, char_state_tab, start_p, trans_p, emit_p), \
+                    "Test PossegHMMModel viterbi error on content: %s" % content
+        print("testPossegHMMModel", file=sys.stderr)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,18 @@
+import sys
+import time
+sys.path.append("../../")
+import jieba
+
+url = sys.argv[1]
+ptk = jieba.ParallelTokenizer(jieba.dt)
+
+t1 = time.time()
+size = 0
+with open(url, "rb") as f, open("1.log", "wb") as log_f:
+    for word in ptk.cut_lines(f):
+        size += len(word.encode('utf-8'))
+        log_f.write((word + "/ ").encode('utf-8'))
+t2 = time.time()
+ptk.close()
+
+print('speed %s bytes/second' % (size / (t2 - t1)))
@@ -0,0 +1,32 @@
+#encoding=utf-8
+from __future__ import print_function
+import sys
+import time
+import random
+sys.path.append("../")
+from jieba import finalseg
+
+# compare the finalseg Viterbi decoders on the Chinese blocks of a file, or
+# on generated runs of unknown characters:
+#     python test_hmm_decoders.py [file]
+if len(sys.argv) > 1:
+    content = open(sys.argv[1], "rb").read().decode("utf-8")
+    groups = [finalseg.re_han.findall(content)]
+else:
+    rnd = random.Random(0)
+    groups = [["".join("%c" % rnd.randint(0x4E00, 0x9FA5) for _ in range(n))]
+              for n in (10, 100, 1000, 5000)]
+
+for name in sorted(finalseg.DECODERS):
+    if name == 'numpy' and finalseg.numpy is None:
+        continue
+    decode = finalseg.DECODERS[name]
+    decode(groups[0][0])
+    for blocks in groups:
+        chars = sum(len(blk) for blk in blocks)
+        t1 = time.time()
+        for blk in blocks:
+            decode(blk)
+        tm_cost = max(time.time() - t1, 1e-6)
+        print('%-12s %7d chars  cost %.4f  speed %d chars/second' % (
+            name, chars, tm_cost, chars / tm_cost))